@@ -0,0 +1,235 @@
+"""
+Офлайн-бенчмарк горячего пути сообщений на фейковых объектах Discord и временной папке resources/
+
+python bench.py [--messages 20000] [--alloc-messages 2000] [--users 5000] [--guilds 20] [--seed 0] [--save] [--compare [коммит]]
+
+Пиковая память на сообщение считается через tracemalloc.reset_peak (Python 3.9+), на старых версиях выводится n/a
+"""
+import argparse
+import asyncio
+import tracemalloc
+from json import dump, load
+from os import chdir, makedirs, path
+from random import Random
+from statistics import quantiles
+from subprocess import run, PIPE
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+ROOT = path.dirname(path.abspath(__file__))
+RESULTS_PATH = path.join(ROOT, 'bench_results.json')
+
+
+class FakeUser:
+    def __init__(self, user_id, name, bot=False):
+        self.id = user_id
+        self.name = name
+        self.bot = bot
+
+    @property
+    def mention(self):
+        return f'<@{self.id}>'
+
+
+class FakeGuild:
+    def __init__(self, guild_id):
+        self.id = guild_id
+
+
+class FakeChannel:
+    def __init__(self, channel_id):
+        self.id = channel_id
+
+    async def send(self, *args, **kwargs):
+        return None
+
+
+class FakeMessage:
+    def __init__(self, content, author, guild, channel):
+        self.content = content
+        self.author = author
+        self.guild = guild
+        self.channel = channel
+        self._state = None
+
+
+class FakeContext:
+    def __init__(self, message):
+        self.message = message
+        self.author = message.author
+        self.guild = message.guild
+        self.channel = message.channel
+        self.send = message.channel.send
+
+
+def prepare_resources(directory, guilds):
+    makedirs(path.join(directory, 'resources'))
+    prefixes = {str(guild): ('!', 'r!')[guild % 2] for guild in range(guilds) if guild % 3 == 0}
+    with open(path.join(directory, 'resources', 'prefixes.json'), 'w') as f:
+        dump(prefixes, f)
+
+
+def make_messages(rng, users, guilds, count):
+    contents = ['привет', 'енот дня', 'ну и дела, ребята', '?lb', '!rank', 'r!cookies', '?неткоманды']
+    channels = {guild.id: FakeChannel(10_000 + guild.id) for guild in guilds}
+    messages = []
+    for _ in range(count):
+        author = rng.choice(users)
+        guild = None if rng.random() < 0.1 else rng.choice(guilds)
+        channel = channels[guild.id] if guild else FakeChannel(author.id)
+        messages.append(FakeMessage(rng.choice(contents), author, guild, channel))
+    return messages
+
+
+def percentile_stats(latencies):
+    cuts = quantiles(latencies, n=100)
+    return cuts[49], cuts[98]
+
+
+async def measure(name, step, items, alloc_items):
+    """
+    Первый проход меряет время, второй под tracemalloc меряет память на сообщение
+    """
+    latencies = []
+    started = perf_counter()
+    for item in items:
+        before = perf_counter()
+        result = step(item)
+        if asyncio.iscoroutine(result):
+            await result
+        latencies.append(perf_counter() - before)
+    elapsed = perf_counter() - started
+
+    reset_peak = getattr(tracemalloc, 'reset_peak', None)
+    tracemalloc.start()
+    peak_total = 0
+    current_start, _ = tracemalloc.get_traced_memory()
+    for item in alloc_items:
+        current, _ = tracemalloc.get_traced_memory()
+        if reset_peak is not None:
+            reset_peak()
+        result = step(item)
+        if asyncio.iscoroutine(result):
+            await result
+        peak_total += tracemalloc.get_traced_memory()[1] - current
+    current_end, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    p50, p99 = percentile_stats(latencies)
+    return {
+        'name': name,
+        'ops': len(items),
+        'ops_per_sec': len(items) / elapsed,
+        'p50_us': p50 * 1e6,
+        'p99_us': p99 * 1e6,
+        'peak_bytes_per_op': peak_total / len(alloc_items) if reset_peak is not None else None,
+        'retained_bytes_per_op': (current_end - current_start) / len(alloc_items)
+    }
+
+
+async def run_benchmarks(args):
+    from discord.ext.commands import Bot
+    from cookies import Cookies, ledger
+    from guild_config import prefix
+    from utils import sform
+
+    rng = Random(args.seed)
+    bot = Bot(command_prefix=prefix, case_insensitive=True)
+    bot._connection.user = FakeUser(1, 'RaccoonBot', bot=True)
+    cog = Cookies(bot)
+    bot.add_cog(cog)
+
+    users = [FakeUser(100 + i, f'user{i}') for i in range(args.users)]
+    for user in users:
+        ledger.open(user.id, user.name, rng.randrange(0, 100_000))
+        for guild in rng.sample(range(args.guilds), min(args.guilds, 3)):
+            ledger.board.join(guild, user.id)
+    guilds = [FakeGuild(i) for i in range(args.guilds)]
+    messages = make_messages(rng, users, guilds, args.messages)
+    alloc_messages = messages[:args.alloc_messages]
+    contexts = [FakeContext(message) for message in messages]
+    numbers = [rng.randrange(0, 10_000) for _ in range(args.messages)]
+    words = ['печенька', 'трек', 'сообщение']
+
+    results = [
+        await measure('prefix', lambda message: prefix(bot, message), messages, alloc_messages),
+        await measure('Cookies.on_message', cog.on_message, messages, alloc_messages),
+        await measure('Cookies.leaderboard_', lambda ctx: Cookies.leaderboard_.callback(cog, ctx), contexts, contexts[:args.alloc_messages]),
+        await measure('sform', lambda num: sform(num, words[num % 3]), numbers, numbers[:args.alloc_messages])
+    ]
+    cog.cog_unload()
+    for task in asyncio.all_tasks():
+        if task is not asyncio.current_task():
+            task.cancel()
+    ledger.close()
+    return results
+
+
+def current_commit():
+    result = run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, stdout=PIPE, stderr=PIPE, universal_newlines=True)
+    if result.returncode:
+        return 'unknown'
+    dirty = run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT, stdout=PIPE, universal_newlines=True).stdout.strip()
+    return result.stdout.strip() + ('-dirty' if dirty else '')
+
+
+def load_results():
+    if not path.exists(RESULTS_PATH):
+        return {}
+    with open(RESULTS_PATH, 'r') as f:
+        return load(f)
+
+
+def report(results, baseline=None):
+    print(f'{"case":<22}{"msg/s":>12}{"p50 us":>10}{"p99 us":>10}{"peak B/op":>12}{"kept B/op":>12}')
+    for result in results:
+        peak = 'n/a' if result['peak_bytes_per_op'] is None else f'{result["peak_bytes_per_op"]:,.0f}'
+        line = (f'{result["name"]:<22}{result["ops_per_sec"]:>12,.0f}{result["p50_us"]:>10.1f}{result["p99_us"]:>10.1f}'
+                f'{peak:>12}{result["retained_bytes_per_op"]:>12,.1f}')
+        old = (baseline or {}).get(result['name'])
+        if old:
+            line += f'   {result["ops_per_sec"] / old["ops_per_sec"] - 1:+.1%} msg/s, {result["p99_us"] / old["p99_us"] - 1:+.1%} p99'
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmark of the message hot path')
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--alloc-messages', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--guilds', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--save', action='store_true', help=f'save results for this commit to {path.basename(RESULTS_PATH)}')
+    parser.add_argument('--compare', nargs='?', const='last', help='compare with a saved commit (default: last saved)')
+    args = parser.parse_args()
+
+    with TemporaryDirectory() as directory:
+        prepare_resources(directory, args.guilds)
+        chdir(directory)
+        try:
+            results = asyncio.get_event_loop().run_until_complete(run_benchmarks(args))
+        finally:
+            chdir(ROOT)
+
+    saved = load_results()
+    baseline = None
+    if args.compare:
+        commit = list(saved)[-1] if args.compare == 'last' and saved else args.compare
+        if commit in saved:
+            print(f'Compared with {commit}')
+            baseline = {result['name']: result for result in saved[commit]}
+        else:
+            print(f'No saved results for {commit}')
+    report(results, baseline)
+
+    if args.save:
+        commit = current_commit()
+        saved.pop(commit, None)
+        saved[commit] = results
+        with open(RESULTS_PATH, 'w') as f:
+            dump(saved, f, indent=2)
+        print(f'Saved results for {commit}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+import sqlite3
+from asyncio import get_event_loop, ensure_future, shield
+from collections import OrderedDict
+from json import dumps, loads
+from threading import Lock
+from time import time, monotonic
+
+caches = {}
+missing = object()
+
+
+class TTLCache:
+    """
+    LRU-кэш в памяти со сроком жизни, негативным кэшированием и объединением одинаковых запросов
+    """
+
+    def __init__(self, name, maxsize=1024, ttl=600, negative_ttl=60):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._data = OrderedDict()
+        self._inflight = {}
+        if name is not None:
+            caches[name] = self
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        expires, value = entry
+        if expires <= monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value, ttl=None):
+        self._data[key] = (monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    async def _load(self, key, loader, negative):
+        try:
+            value = await loader()
+            self.set(key, value, self.negative_ttl if negative(value) else None)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    async def get_or_load(self, key, loader, negative=lambda value: not value):
+        value = self.get(key, missing)
+        if value is not missing:
+            self.hits += 1
+            return value
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            task = self._inflight[key] = ensure_future(self._load(key, loader, negative))
+        else:
+            self.coalesced += 1
+        return await shield(task)
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses + self.coalesced
+        return (self.hits + self.coalesced) / total if total else 0.0
+
+    def __str__(self):
+        return f'{len(self)}/{self.maxsize} entries, {self.hits} hits, {self.misses} misses, {self.coalesced} coalesced ({self.hit_rate:.0%})'
+
+
+class DiskCache:
+    """
+    Ключ-значение в SQLite со сроком жизни записей
+    """
+
+    def __init__(self, table, db_path='resources/cache.db', ttl=None):
+        self.table = table
+        self.ttl = ttl
+        self._lock = Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(f'CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL)')
+        self._db.commit()
+
+    def _get_many(self, keys):
+        now = time()
+        result = {}
+        with self._lock:
+            for key in keys:
+                row = self._db.execute(f'SELECT value, expires FROM {self.table} WHERE key = ?', (key,)).fetchone()
+                if row and (row[1] is None or row[1] > now):
+                    result[key] = loads(row[0])
+        return result
+
+    def _set_many(self, items, ttl):
+        ttl = self.ttl if ttl is None else ttl
+        expires = time() + ttl if ttl else None
+        with self._lock, self._db:
+            self._db.executemany(f'INSERT OR REPLACE INTO {self.table} (key, value, expires) VALUES (?, ?, ?)',
+                                 [(key, dumps(value), expires) for key, value in items.items()])
+
+    def _delete(self, key):
+        with self._lock, self._db:
+            self._db.execute(f'DELETE FROM {self.table} WHERE key = ?', (key,))
+
+    def _purge(self):
+        with self._lock, self._db:
+            return self._db.execute(f'DELETE FROM {self.table} WHERE expires IS NOT NULL AND expires <= ?', (time(),)).rowcount
+
+    async def get_many(self, keys):
+        return await get_event_loop().run_in_executor(None, self._get_many, [str(key) for key in keys])
+
+    async def get(self, key):
+        return (await self.get_many([key])).get(str(key))
+
+    async def set_many(self, items, ttl=None):
+        items = {str(key): value for key, value in items.items()}
+        if items:
+            await get_event_loop().run_in_executor(None, self._set_many, items, ttl)
+
+    async def set(self, key, value, ttl=None):
+        await self.set_many({key: value}, ttl)
+
+    async def delete(self, key):
+        await get_event_loop().run_in_executor(None, self._delete, str(key))
+
+    async def purge(self):
+        return await get_event_loop().run_in_executor(None, self._purge)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
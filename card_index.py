@@ -0,0 +1,65 @@
+import regex as re
+
+word_rx = re.compile(r'\w+')
+
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class CardIndex:
+    """
+    Триграммный индекс по searchableText карт Shadowverse
+    """
+
+    def __init__(self, cards):
+        self.cards = cards
+        self.texts = {}
+        self.names = {}
+        self.words = {}
+        self.postings = {}
+        for card_id, card in cards.items():
+            text = card['searchableText'].lower()
+            self.texts[card_id] = text
+            self.names[card_id] = card['name'].lower()
+            self.words[card_id] = set(word_rx.findall(text))
+            for gram in trigrams(text):
+                posting = self.postings.get(gram)
+                if posting is None:
+                    self.postings[gram] = {card_id}
+                else:
+                    posting.add(card_id)
+
+    def candidates(self, terms):
+        grams = set()
+        for term in terms:
+            grams |= trigrams(term)
+        if not grams:
+            return self.texts.keys()
+        postings = sorted((self.postings.get(gram, ()) for gram in grams), key=len)
+        result = set(postings[0])
+        for posting in postings[1:]:
+            if not result:
+                break
+            result &= posting
+        return result
+
+    def rank(self, card_id, query, terms):
+        name = self.names[card_id]
+        if name == query:
+            exact = 0
+        elif all(term in name for term in terms):
+            exact = 1
+        else:
+            exact = 2
+        whole = sum(term in self.words[card_id] for term in terms)
+        return exact, -whole, name, card_id
+
+    def search(self, query, limit=10):
+        query = query.lower().strip()
+        terms = query.split()
+        if not terms:
+            return []
+        matches = [card_id for card_id in self.candidates(terms) if all(term in self.texts[card_id] for term in terms)]
+        matches.sort(key=lambda card_id: self.rank(card_id, query, terms))
+        return [self.cards[card_id] for card_id in matches[:limit]]
@@ -0,0 +1,67 @@
+from asyncio import get_event_loop, Lock
+from os import getcwd, path
+from time import gmtime, strftime
+
+from git import Repo
+
+
+class Changelog:
+    """
+    Последние уникальные коммиты бота; собираются в отдельном потоке и пересобираются при смене HEAD
+    """
+
+    def __init__(self, repo_path=None, branch='master', size=20):
+        self.repo_path = repo_path or getcwd()
+        self.branch = branch
+        self.size = size
+        self.head = None
+        self.entries = ()
+        self._lock = Lock()
+
+    def read_head(self):
+        git_dir = path.join(self.repo_path, '.git')
+        ref = f'refs/heads/{self.branch}'
+        try:
+            with open(path.join(git_dir, ref), 'r') as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            pass
+        try:
+            with open(path.join(git_dir, 'packed-refs'), 'r') as f:
+                for line in f:
+                    if line.rstrip().endswith(' ' + ref):
+                        return line.split(' ', 1)[0]
+        except FileNotFoundError:
+            pass
+        return None
+
+    def _build(self):
+        repo = Repo(self.repo_path)
+        head = repo.commit(self.branch).hexsha
+        entries = []
+        seen = set()
+        for commit in repo.iter_commits(self.branch):
+            if commit.message in seen:
+                continue
+            seen.add(commit.message)
+            entries.append(f'{strftime("%d-%m-%Y", gmtime(commit.authored_date - commit.author_tz_offset))}: {commit.message.strip()}')
+            if len(entries) == self.size:
+                break
+        return head, tuple(entries)
+
+    async def refresh(self, force=True):
+        async with self._lock:
+            if force or self.head is None or self.read_head() != self.head:
+                try:
+                    self.head, self.entries = await get_event_loop().run_in_executor(None, self._build)
+                except Exception as e:
+                    print(f'Failed to build changelog: {e}')
+        return self.entries
+
+    async def get(self):
+        if self.head is not None and self.read_head() == self.head:
+            return self.entries
+        return await self.refresh(force=False)
+
+
+changelog = Changelog()
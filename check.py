@@ -1,17 +1,75 @@
+from asyncio import gather, Semaphore
+from time import monotonic
+
 from credentials import discord_message_id, discord_channel_id, discord_guild_id, emoji_to_role
 
 
-async def check(bot):
+class Reconciliation:
+    def __init__(self, guild, changes, dry_run):
+        self.guild = guild
+        self.changes = changes
+        self.dry_run = dry_run
+        self.failed = []
+        self.plan_time = 0.0
+        self.apply_time = 0.0
+
+    def __str__(self):
+        lines = []
+        for member, add, remove in self.changes:
+            diff = [f'+{self.guild.get_role(role_id)}' for role_id in add] + [f'-{self.guild.get_role(role_id)}' for role_id in remove]
+            lines.append(f'{member}: {" ".join(diff)}')
+        mode = 'dry run' if self.dry_run else f'{len(self.changes) - len(self.failed)} applied, {len(self.failed)} failed'
+        lines.append(f'{len(self.changes)} members to update ({mode}); plan {self.plan_time:.2f}s, apply {self.apply_time:.2f}s')
+        return '\n'.join(lines)
+
+
+def emoji_name(emoji):
+    return getattr(emoji, 'name', emoji)
+
+
+async def plan(guild, message):
+    managed = set(emoji_to_role.values())
+    desired = {}
+    for reaction in message.reactions:
+        role_id = emoji_to_role.get(emoji_name(reaction.emoji))
+        if role_id is None:
+            continue
+        async for user in reaction.users():
+            desired.setdefault(user.id, set()).add(role_id)
+    changes = []
+    for member in guild.members:
+        if member.bot:
+            continue
+        current = {role.id for role in member.roles} & managed
+        wanted = desired.get(member.id, set())
+        add, remove = wanted - current, current - wanted
+        if add or remove:
+            changes.append((member, add, remove))
+    return changes
+
+
+async def apply(guild, member, add, remove, semaphore):
+    roles = [role for role in member.roles if not role.is_default() and role.id not in remove]
+    roles.extend(guild.get_role(role_id) for role_id in add)
+    async with semaphore:
+        await member.edit(roles=roles, reason='Reaction roles')
+
+
+async def check(bot, dry_run=False, concurrency=4):
+    started = monotonic()
     guild = bot.get_guild(discord_guild_id)
     channel = guild.get_channel(discord_channel_id)
     message = await channel.fetch_message(discord_message_id)
-    reactions = message.reactions
-    for reaction in reactions:
-        users = await reaction.users().flatten()
-        role = guild.get_role(emoji_to_role[reaction.emoji.name])
-        for member in guild.members:
-            if not member.bot:
-                if member in users and role not in member.roles:
-                    await member.add_roles(role)
-                elif member not in users and role in member.roles:
-                    await member.remove_roles(role)
+    result = Reconciliation(guild, await plan(guild, message), dry_run)
+    result.plan_time = monotonic() - started
+    if not dry_run and result.changes:
+        started = monotonic()
+        semaphore = Semaphore(concurrency)
+        outcomes = await gather(*(apply(guild, member, add, remove, semaphore) for member, add, remove in result.changes),
+                                return_exceptions=True)
+        for (member, _, _), outcome in zip(result.changes, outcomes):
+            if isinstance(outcome, Exception):
+                print(f'Failed to update roles of {member}: {outcome}')
+                result.failed.append(member)
+        result.apply_time = monotonic() - started
+    return result
@@ -1,12 +1,16 @@
-from json import load, dump
 from asyncio import sleep
+from time import monotonic
 from random import randrange, randint
 
 from discord import Status, Embed, Color
 from discord.ext.commands import Cog, command, Bot
 
+from ledger import Ledger, WalletError
+from metrics import metrics
 from utils import sform
 
+ledger = Ledger()
+
 
 def gen_deck():
     values = [('Туз', 11), ('2', 2), ('3', 3), ('4', 4), ('5', 5), ('6', 6), ('7', 7), ('8', 8), ('9', 9), ('10', 10),
@@ -23,48 +27,57 @@ def draw(deck):
     return deck.pop(randint(0, len(deck) - 1))
 
 
-def add(userid, amt):
-    cookies = load(open('resources/cookies.json', 'r'))
-    cookies[str(userid)]['cookies'] += amt
-    dump(cookies, open('resources/cookies.json', 'w'))
-
-
 def get_cookies(userid):
-    cookies = load(open('resources/cookies.json', 'r')).get(str(userid), None)
-    if cookies is None:
-        return None
-    cookies = cookies['cookies']
-    return cookies
+    return ledger.get(userid)
 
 
 class Cookies(Cog):
     def __init__(self, bot: Bot):
         self.bot = bot
+        self.online = {}
+        self.voice = set()
+        for guild in self.bot.guilds:
+            self.track_guild(guild)
         self.bot.loop.create_task(self.add_cookies())
+        self.flusher = self.bot.loop.create_task(ledger.run())
+
+    def track_guild(self, guild):
+        for member in guild.members:
+            if not member.bot:
+                ledger.board.join(guild.id, member.id)
+                self.track_presence(member)
+                if member.voice and member.voice.channel:
+                    self.voice.add(member.id)
+
+    def track_presence(self, member):
+        if member.status == Status.online:
+            self.online[member.id] = member.name
+        else:
+            self.online.pop(member.id, None)
+
+    def untrack(self, user_id):
+        self.online.pop(user_id, None)
+        self.voice.discard(user_id)
+
+    def cog_unload(self):
+        self.flusher.cancel()
+        self.bot.loop.create_task(ledger.flush())
 
     async def add_cookies(self):
         while True:
             try:
-                guilds = self.bot.guilds
-                cookies = load(open('resources/cookies.json', 'r'))
-                online = {}
-                for guild in guilds:
-                    members = guild.members
-                    for member in members:
-                        if member.status == Status.online and not member.bot:
-                            voice = bool(member.voice)
-                            if (str(member.id) not in online.keys()) or voice:
-                                online[str(member.id)] = {'nick': member.name, 'voice': voice}
-                for user_id in online.keys():
-                    if str(user_id) in cookies.keys():
-                        if online[user_id]['voice']:
-                            cookies[user_id]['cookies'] += randrange(31, 35)
+                started = monotonic()
+                for user_id, name in self.online.items():
+                    if user_id in ledger:
+                        if user_id in self.voice:
+                            ledger.add(user_id, randrange(31, 35))
                         else:
-                            cookies[user_id]['cookies'] += randrange(11, 15)
+                            ledger.add(user_id, randrange(11, 15))
                     else:
-                        cookies[user_id] = {'id': int(user_id), 'name': online[user_id]['nick'],
-                                            'cookies': randrange(289, 296)}
-                dump(cookies, open('resources/cookies.json', 'w'))
+                        ledger.open(user_id, name, randrange(289, 296))
+                elapsed = monotonic() - started
+                metrics.observe('loop', 'add_cookies', elapsed)
+                print(f'Cookies tick: {len(self.online)} users credited in {elapsed * 1000:.1f}ms')
             except Exception as e:
                 print(f'Exception in cookies loop:\n{e}')
             finally:
@@ -73,22 +86,55 @@ class Cookies(Cog):
     @Cog.listener()
     async def on_member_join(self, member):
         if not member.bot:
-            cookies = load(open('resources/cookies.json', 'r'))
-            if str(member.id) not in cookies.keys():
-                cookies[str(member.id)] = {'id': member.id, 'name': member.name, 'cookies': randrange(289, 296)}
-            dump(cookies, open('resources/cookies.json', 'w'))
+            ledger.open(member.id, member.name, randrange(289, 296))
+            ledger.board.join(member.guild.id, member.id)
+
+    @Cog.listener()
+    async def on_member_remove(self, member):
+        ledger.board.leave(member.guild.id, member.id)
+        if not ledger.board.user_guilds.get(member.id):
+            self.untrack(member.id)
+
+    @Cog.listener()
+    async def on_member_update(self, before, after):
+        if not after.bot and before.status != after.status:
+            self.track_presence(after)
+
+    @Cog.listener()
+    async def on_presence_update(self, before, after):
+        if not after.bot and before.status != after.status:
+            self.track_presence(after)
+
+    @Cog.listener()
+    async def on_voice_state_update(self, member, before, after):
+        if member.bot:
+            return
+        if after.channel:
+            self.voice.add(member.id)
+        else:
+            self.voice.discard(member.id)
+
+    @Cog.listener()
+    async def on_guild_join(self, guild):
+        self.track_guild(guild)
+
+    @Cog.listener()
+    async def on_guild_remove(self, guild):
+        members = [member.id for member in guild.members]
+        ledger.board.remove_guild(guild.id)
+        for user_id in members:
+            if not ledger.board.user_guilds.get(user_id):
+                self.untrack(user_id)
 
     @Cog.listener()
     async def on_message(self, message):
         ctx = await self.bot.get_context(message)
         user = ctx.author
         if not user.bot and not ctx.valid:
-            cookies = load(open('resources/cookies.json', 'r'))
-            if str(user.id) not in cookies.keys():
-                cookies[str(user.id)] = {'id': user.id, 'name': user.name, 'cookies': randrange(289, 296)}
+            if user.id not in ledger:
+                ledger.open(user.id, user.name, randrange(289, 296))
             else:
-                cookies[str(user.id)]['cookies'] += randrange(10, 17)
-            dump(cookies, open('resources/cookies.json', 'w'))
+                ledger.add(user.id, randrange(10, 17))
 
     @command(name='cookies', aliases=['points'], help='Команда для отображения печенек')
     async def cookies_(self, ctx):
@@ -99,30 +145,46 @@ class Cookies(Cog):
         return await ctx.send(
             'У {} {:,} {}'.format(user.mention, cookies, sform(cookies, 'печенька')))
 
+    @staticmethod
+    def format_board(user_ids, start=0, highlight=None):
+        embedValue = ''
+        for i, user_id in enumerate(user_ids, start=start + 1):
+            account = ledger.accounts[user_id]
+            amt = account['cookies']
+            line = '{}. {}: {:,} {}'.format(i, account['name'], amt, sform(amt, 'печенька'))
+            if user_id == highlight:
+                line = f'**{line}**'
+            embedValue += line + '\n\n'
+        return embedValue or '\u200b'
+
     @command(name='leaderboard', aliases=['lb'], help='Команда для отображения топа печенек')
     async def leaderboard_(self, ctx):
-        cookies = load(open('resources/cookies.json', 'r'))
-        cookies = sorted(cookies.items(), key=lambda kv: kv[1]['cookies'], reverse=True)
-        length = 10 if len(cookies) > 10 else len(cookies)
         embed = Embed(color=Color.dark_purple())
-        embedValue = ''
-        for i in range(length):
-            amt = cookies[i][1]['cookies']
-            embedValue += '{}. {}: {:,} {}\n\n'.format(i + 1, cookies[i][1]['name'], amt, sform(amt, 'печенька'))
-        embed.add_field(name='Глобальный топ', value=embedValue, inline=False)
-        embed.add_field(name='\u200b', value='\u200b', inline=False)
-        embedValue = ''
-        i = 0
-        for holder in cookies:
-            if ctx.guild.get_member(holder[1]['id']) is not None:
-                amt = holder[1]['cookies']
-                embedValue += '{}. {}: {:,} {}\n\n'.format(i + 1, holder[1]['name'], amt, sform(amt, 'печенька'))
-                i += 1
-                if i == length:
-                    break
-        embed.add_field(name='Топ сервера', value=embedValue, inline=False)
+        embed.add_field(name='Глобальный топ', value=self.format_board(ledger.board.top(10)), inline=False)
+        if ctx.guild:
+            embed.add_field(name='\u200b', value='\u200b', inline=False)
+            embed.add_field(name='Топ сервера', value=self.format_board(ledger.board.top(10, ctx.guild.id)), inline=False)
         return await ctx.send('{}'.format(ctx.author.mention), embed=embed)
 
+    @command(name='rank', aliases=['place'], help='Команда для отображения вашего места в топе печенек',
+             usage='rank [страница]')
+    async def rank_(self, ctx, page: int = None):
+        user = ctx.author
+        guild_id = ctx.guild.id if ctx.guild else None
+        position = ledger.board.rank(user.id, guild_id)
+        if position is None:
+            return await ctx.send('У {} нет печенек'.format(user.mention))
+        total = ledger.board.size(guild_id)
+        pages = (total + 9) // 10
+        page = position // 10 if page is None else min(max(page, 1), pages) - 1
+        embed = Embed(color=Color.dark_purple(), title='Топ сервера' if guild_id else 'Глобальный топ',
+                      description=self.format_board(ledger.board.top(10, guild_id, page * 10), page * 10, user.id))
+        footer = f'Ваше место: {position + 1}'
+        if guild_id:
+            footer += f' (глобально: {ledger.board.rank(user.id) + 1})'
+        embed.set_footer(text=f'{footer}\nСтраница {page + 1}/{pages}')
+        return await ctx.send(user.mention, embed=embed)
+
     @command(name='blackjack', aliases=['bj'], help='Команда для игры в Блэкджек\nПравила:\n- Дилер перестает брать на 17',
              usage='blackjack <ставка>')
     async def bj_(self, ctx, amt: int):
@@ -132,11 +194,19 @@ class Cookies(Cog):
         cookies = get_cookies(user.id)
         if cookies is None:
             return await ctx.send('У вас нет печенек')
-        if amt > cookies:
-            return await ctx.send('У вас недостаточно печенек ({:,}, а необходимо {:,})'.format(cookies, amt))
+        if amt > ledger.available(user.id):
+            return await ctx.send('У вас недостаточно печенек ({:,}, а необходимо {:,})'.format(ledger.available(user.id), amt))
+        try:
+            escrow = ledger.escrow(user.id)
+        except WalletError as e:
+            return await ctx.send(str(e))
+        with escrow:
+            escrow.reserve(amt)
+            return await self.play_bj(ctx, escrow, amt)
+
+    async def play_bj(self, ctx, escrow, amt):
+        user = ctx.author
         deck = gen_deck()
-        add(user.id, -1 * amt)
-        cookies = get_cookies(user.id)
         fst, snd, trd, frt = draw(deck), draw(deck), draw(deck), draw(deck)
         hand = [fst[1], trd[1]]
         split = [hand]
@@ -149,19 +219,19 @@ class Cookies(Cog):
         embed = Embed(color=Color.dark_purple(), title='Ход игры', description=embedValue)
         msg = await ctx.send(embed=embed)
         if sum(split[0]) == 21:
-            add(user.id, amt * 2)
-            cookies = get_cookies(user.id)
+            escrow.pay(amt * 2)
+            cookies = escrow.balance
             embed.description += '\n\nУ вас блэкджек, вы выиграли\nТеперь у вас {:,} {}'.format(cookies, sform(cookies, 'печенька'))
             return await msg.edit(embed=embed)
         if sum(dealer) == 21:
-            cookies = get_cookies(user.id)
+            cookies = escrow.balance
             embed.description += '\n\nУ дилера блэкджек, вы проиграли\nТеперь у вас {:,} {}'.format(cookies, sform(cookies, 'печенька'))
             return await msg.edit(embed=embed)
 
         def verify(m):
             if m.content.lower() in ['hit', 'stand']:
                 return m.author == user and m.channel == ctx.message.channel
-            if m.content.lower() == 'dd' and cookies >= amt:
+            if m.content.lower() == 'dd' and ledger.available(user.id) >= amt:
                 return m.author == user and m.channel == ctx.message.channel
             return False
 
@@ -170,13 +240,13 @@ class Cookies(Cog):
                 return m.author == user and m.channel == ctx.message.channel
             return False
 
-        if split[0][0] == split[0][1] and cookies >= amt:
+        if split[0][0] == split[0][1] and ledger.available(user.id) >= amt:
             embed.description += '\n\nХотите разделить руку? (да/нет)\nАвтоматическая отмена через 300 секунд'
             await msg.edit(embed=embed)
             response = await self.bot.wait_for('message', check=versplit, timeout=300)
             if response.content.lower() == 'да':
                 split = ([hand[0]], [hand[1]])
-                add(user.id, -1 * amt)
+                escrow.reserve(amt)
                 spamt = [amt] * 2
         num = 0
         snum = ''
@@ -190,8 +260,7 @@ class Cookies(Cog):
                 Сумма карт у вас в руке{} - {}
                 Хотите взять карту?
                 (hit - взять, stand - пас)'''.format(snum, sum(hand))
-                cookies = get_cookies(user.id)
-                if cookies >= amt:
+                if ledger.available(user.id) >= amt:
                     embed.description += '\nВы можете удвоить ставку (dd)'
                 embed.description += '\nАвтоматическая отмена через 300 секунд'
                 await msg.edit(embed=embed)
@@ -209,12 +278,12 @@ class Cookies(Cog):
                             hand[hand.index(11)] = 1
                             await msg.edit(embed=embed)
                         else:
-                            cookies = get_cookies(user.id)
+                            cookies = escrow.balance
                             embed.description += '\n\nУ вас больше 21 очка, вы проиграли\nТеперь у вас {:,} {}'.format(cookies, sform(cookies, 'печенька'))
                             await msg.edit(embed=embed)
                             break
                 if response.content.lower() == 'dd':
-                    add(user.id, -1 * amt)
+                    escrow.reserve(amt)
                     if len(split) == 2:
                         # noinspection PyUnboundLocalVariable
                         spamt[num - 1] *= 2
@@ -233,7 +302,7 @@ class Cookies(Cog):
                             hand[hand.index(11)] = 1
                             await msg.edit(embed=embed)
                         else:
-                            cookies = get_cookies(user.id)
+                            cookies = escrow.balance
                             embed.description += '\n\nУ вас больше 21 очка, вы проиграли\nТеперь у вас {:,} {}'.format(cookies, sform(cookies, 'печенька'))
                             await msg.edit(embed=embed)
                             break
@@ -259,10 +328,10 @@ class Cookies(Cog):
                     if len(split) == 2:
                         for i in range(len(split)):
                             if sum(split[i]) <= 21:
-                                add(user.id, spamt[i] * 2)
+                                escrow.pay(spamt[i] * 2)
                     else:
-                        add(user.id, amt * 2)
-                    cookies = get_cookies(user.id)
+                        escrow.pay(amt * 2)
+                    cookies = escrow.balance
                     embed.description += '\nУ дилера больше 21 очка, вы победили\nТеперь у вас {:,} {}'.format(cookies, sform(cookies, 'печенька'))
                     return await msg.edit(embed=embed)
         embed.description += '\nСумма карт в руке в дилера - {}'.format(sum(dealer))
@@ -275,19 +344,19 @@ class Cookies(Cog):
                     embed.description += '\n\nРука {}'.format(num)
                     amt = spamt[num - 1]
                 if sum(dealer) == sum(hand):
-                    add(user.id, amt)
-                    cookies = get_cookies(user.id)
+                    escrow.pay(amt)
+                    cookies = escrow.balance
                     embed.description += '\nУ вас одинаковый счет, вам возвращена ставка\nТеперь у вас {:,} {}'.format(cookies, sform(cookies, 'печенька'))
                     await msg.edit(embed=embed)
                 if sum(dealer) > sum(hand):
-                    cookies = get_cookies(user.id)
+                    cookies = escrow.balance
                     embed.description += '\nУ вас меньше очков, чем у дилера\nВы проиграли\nТеперь у вас {:,} {}'.format(cookies,
                                                                                                                          sform(cookies, 'печенька'))
                     await msg.edit(embed=embed)
                 if sum(hand) > sum(dealer):
-                    cookies = get_cookies(user.id)
-                    add(user.id, amt * 2)
-                    cookies = get_cookies(user.id)
+                    cookies = escrow.balance
+                    escrow.pay(amt * 2)
+                    cookies = escrow.balance
                     embed.description += '\nУ вас больше очков, чем у дилера\nВы победили\nТеперь у вас {:,} {}'.format(cookies, sform(cookies, 'печенька'))
                     await msg.edit(embed=embed)
 
@@ -0,0 +1,128 @@
+from asyncio import gather, TimeoutError
+from html import unescape
+
+import regex as re
+from aiohttp import ClientError
+
+from cache import TTLCache
+from http_client import http
+
+
+def api_url(wiki_url):
+    return wiki_url.rstrip('/') + '/api/v1/'
+
+
+def scale_thumbnail(thumb, dims, width=200):
+    if thumb is None or dims is None:
+        return thumb
+    width = int(min(dims['width'], width))
+    return re.sub(r'(/revision/latest)[^?]*', rf'\g<1>/scale-to-width-down/{width}', thumb, count=1)
+
+
+class FandomError(Exception):
+    pass
+
+
+class Fandom:
+    """
+    Поиск вики и статей на Fandom с кэшем и параллельными запросами по языкам
+    """
+    crosswiki = 'https://community.fandom.com/api/v1/Search/CrossWiki'
+
+    def __init__(self, timeout=2, thumb_width=200, limit=10):
+        self.timeout = timeout
+        self.thumb_width = thumb_width
+        self.limit = limit
+        self.wiki_cache = TTLCache('fandom_wikis', maxsize=256, ttl=3600)
+        self.search_cache = TTLCache('fandom_search', maxsize=512, ttl=3600)
+        self.details_cache = TTLCache('fandom_details', maxsize=512, ttl=3600)
+
+    async def _get(self, url, params):
+        try:
+            result = await http.get_json(url, params=params, timeout=self.timeout, retries=0)
+        except (ClientError, TimeoutError) as e:
+            raise FandomError(f'{url}: {e!r}') from e
+        return None if 'exception' in result else result
+
+    async def _wikis(self, query, lang):
+        params = {
+            'expand': 1,
+            'query': query,
+            'lang': lang,
+            'limit': self.limit,
+            'batch': 1,
+            'rank': 'default'
+        }
+        result = await self._get(self.crosswiki, params)
+        if result is None:
+            return []
+        return [{'title': item['title'], 'url': item['url']} for item in result['items'] if item and item['title']]
+
+    async def wikis(self, query, langs=('en', 'ru')):
+        key = query.lower().strip()
+        results = await gather(*(self.wiki_cache.get_or_load((key, lang), lambda lang=lang: self._wikis(query, lang)) for lang in langs),
+                               return_exceptions=True)
+        errors = [result for result in results if isinstance(result, Exception)]
+        if len(errors) == len(results):
+            raise errors[0]
+        wikis, seen = [], set()
+        for result in results:
+            if isinstance(result, Exception):
+                print(f'Fandom CrossWiki search failed: {result}')
+                continue
+            for wiki in result:
+                if wiki['url'] not in seen:
+                    seen.add(wiki['url'])
+                    wikis.append(wiki)
+        return wikis[:self.limit]
+
+    async def _search(self, api, query):
+        params = {
+            'query': query,
+            'namespaces': '0,14',
+            'limit': 1,
+            'minArticleQuality': 0,
+            'batch': 1
+        }
+        result = await self._get(api + 'Search/List', params)
+        if result is None or not result['items']:
+            return None
+        return result['items'][0]
+
+    async def _details(self, api, page_id):
+        params = {
+            'ids': page_id,
+            'abstract': 500,
+            'width': self.thumb_width,
+            'height': self.thumb_width
+        }
+        result = await self._get(api + 'Articles/Details', params)
+        if result is None:
+            return None
+        item = result['items'][str(page_id)]
+        return {
+            'title': item['title'],
+            'url': result['basepath'] + item['url'],
+            'description': unescape(item['abstract']),
+            'thumbnail': scale_thumbnail(item['thumbnail'], item['original_dimensions'], self.thumb_width)
+        }
+
+    async def article(self, wiki_url, query):
+        """
+        Статья по запросу; при таймауте деталей возвращается то, что дал поиск
+        """
+        api = api_url(wiki_url)
+        hit = await self.search_cache.get_or_load((api, query.lower().strip()), lambda: self._search(api, query))
+        if hit is None:
+            return None
+        try:
+            details = await self.details_cache.get_or_load((api, hit['id']), lambda: self._details(api, hit['id']))
+        except FandomError as e:
+            print(f'Fandom details request failed: {e}')
+            details = None
+        if details is None:
+            return {'title': hit['title'], 'url': hit['url'], 'description': '', 'thumbnail': None}
+        return details
+
+
+fandom = Fandom()
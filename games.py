@@ -1,10 +1,14 @@
+from asyncio import gather
 from enum import IntFlag
 
-from aiohttp import ClientSession
 from credentials import osu_key
 from discord import Embed, Color
 from discord.ext.commands import Cog, command, Bot
 
+from cache import DiskCache
+from card_index import CardIndex
+from http_client import http
+
 
 class osumods(IntFlag):
     NoMod = 0,
@@ -41,20 +45,27 @@ class osumods(IntFlag):
     LastMod = 1073741824
 
 
+ranked_statuses = ('1', '2')
+
+
 class Games(Cog):
     def __init__(self, bot: Bot):
         self.bot = bot
+        self.beatmaps = DiskCache('beatmaps')
         self.cards = {}
+        self.index = None
+
+    async def load_cards(self):
+        cards = await http.get_json('https://sv.bagoum.com/cardsFullJSON')
+        self.index = await self.bot.loop.run_in_executor(None, CardIndex, cards) if isinstance(cards, dict) else None
+        self.cards = cards
 
     async def init(self):
-        async with ClientSession() as client:
-            try:
-                cards = await client.get('https://sv.bagoum.com/cardsFullJSON')
-                self.cards = await cards.json()
-            except Exception as e:
-                print(e)
-                cards = await client.get('https://sv.bagoum.com/cardsFullJSON')
-                self.cards = await cards.json()
+        try:
+            await self.load_cards()
+        except Exception as e:
+            print(e)
+            await self.load_cards()
 
     @command(name='osuplayer', aliases=['op'], help='Команда для получения информации о игроке osu!standart',
              usage='osuplayer <ник/id>')
@@ -64,9 +75,7 @@ class Games(Cog):
             'k': osu_key,
             'u': nickname
         }
-        async with ClientSession() as client:
-            r = await client.get(api_link + 'get_user', params=params, timeout=2)
-            r = await r.json()
+        r = await http.get_json(api_link + 'get_user', params=params, timeout=2)
         if not r:
             return await ctx.send('Пользователь не найден')
         result = r[0]
@@ -93,23 +102,15 @@ class Games(Cog):
             'k': osu_key,
             'u': nickname
         }
-        async with ClientSession() as client:
-            plays = await client.get(api_link + 'get_user_best', params=params, timeout=2)
-            plays = await plays.json()
+        plays = await http.get_json(api_link + 'get_user_best', params=params, timeout=2)
         if not plays:
             return await ctx.send('Пользователь не найден')
         embed = Embed(color=Color.dark_purple(), description='Loading...')
         msg = await ctx.send(ctx.author.mention, embed=embed)
+        beatmaps = await self.get_beatmaps([play['beatmap_id'] for play in plays])
         embed = Embed(color=Color.dark_purple())
         for i in range(len(plays)):
-            params = {
-                'k': osu_key,
-                'b': plays[i]['beatmap_id']
-            }
-            async with ClientSession() as client:
-                info = await client.get(api_link + 'get_beatmaps', params=params)
-                info = await info.json()
-                info = info[0]
+            info = beatmaps[plays[i]['beatmap_id']]
             accuracy = round(
                 (int(plays[i]['count300']) * 300 + int(plays[i]['count100']) * 100 + int(
                     plays[i]['count50']) * 50) / (
@@ -127,130 +128,107 @@ class Games(Cog):
             embed.add_field(name=name, value=value, inline=False)
         await msg.edit(content=ctx.author.mention, embed=embed)
 
-    @command(name='svcard', help='Команда для поиска карты из Shadowverse', usage='svcard <запрос>')
-    async def svcard_(self, ctx, *, search):
-        cards = self.cards
-        results = []
-        if not isinstance(cards, dict):
-            return await ctx.send(f'Не удалось получить список карт. Попробуйте использовать {ctx.prefix}svupdate')
+    async def get_beatmaps(self, beatmap_ids):
+        beatmaps = await self.beatmaps.get_many(beatmap_ids)
+        missing = [beatmap_id for beatmap_id in dict.fromkeys(beatmap_ids) if beatmap_id not in beatmaps]
+        if not missing:
+            return beatmaps
+        results = await gather(*(http.get_json('https://osu.ppy.sh/api/get_beatmaps', params={'k': osu_key, 'b': beatmap_id})
+                                 for beatmap_id in missing))
+        ranked, pending = {}, {}
+        for beatmap_id, info in zip(missing, results):
+            info = info[0]
+            beatmaps[beatmap_id] = info
+            if info['approved'] in ranked_statuses:
+                ranked[beatmap_id] = info
+            else:
+                pending[beatmap_id] = info
+        await self.beatmaps.set_many(ranked)
+        await self.beatmaps.set_many(pending, ttl=86400)
+        return beatmaps
+
+    async def choose_card(self, ctx, search):
+        if self.index is None:
+            await ctx.send(f'Не удалось получить список карт. Попробуйте использовать {ctx.prefix}svupdate')
+            return None
         text_channel = ctx.message.channel
         user = ctx.message.author
-        terms = search.split(' ')
-        for card in cards:
-            if all(term.lower() in cards[card]['searchableText'].lower() for term in terms):
-                results.append(cards[card])
-                if len(results) == 10:
-                    break
+        results = self.index.search(search)
         if not results:
-            return await ctx.send('Карты не найдены')
-        else:
-            if len(results) == 1:
-                result = results[0]
-            else:
-                content = ''
-                for i in range(len(results)):
-                    content += '{}. {}\n'.format(i + 1, results[i]['name'])
-                embed = Embed(color=Color.dark_purple(), title='Выберите карту', description=content)
-                embed.set_footer(text='Автоматическая отмена через 30 секунд\nОтправьте 0 для отмены')
-                choice = await ctx.send(embed=embed)
-                canc = False
-                prefixes = await self.bot.get_prefix(ctx.message)
+            await ctx.send('Карты не найдены')
+            return None
+        if len(results) == 1:
+            return results[0]
+        content = ''
+        for i in range(len(results)):
+            content += '{}. {}\n'.format(i + 1, results[i]['name'])
+        embed = Embed(color=Color.dark_purple(), title='Выберите карту', description=content)
+        embed.set_footer(text='Автоматическая отмена через 30 секунд\nОтправьте 0 для отмены')
+        choice = await ctx.send(embed=embed)
+        canc = False
+        prefixes = await self.bot.get_prefix(ctx.message)
+
+        def verify(m):
+            nonlocal canc
+            if m.content.isdigit():
+                return 0 <= int(m.content) <= len(results) and m.channel == text_channel and m.author == user
+            canc = m.channel == text_channel and m.author == user and any(m.content.startswith(prefix) and len(m.content) > len(prefix) for prefix in prefixes)
+            return canc
+
+        msg = await self.bot.wait_for('message', check=verify, timeout=30)
+        if canc or int(msg.content) == 0:
+            await choice.delete()
+            return None
+        return results[int(msg.content) - 1]
 
-                def verify(m):
-                    nonlocal canc
-                    if m.content.isdigit():
-                        return 0 <= int(m.content) <= len(results) and m.channel == text_channel and m.author == user
-                    canc = m.channel == text_channel and m.author == user and any(m.content.startswith(prefix) and len(m.content) > len(prefix) for prefix in prefixes)
-                    return canc
-
-                msg = await self.bot.wait_for('message', check=verify, timeout=30)
-                if canc:
-                    return await choice.delete()
-                if int(msg.content) == 0:
-                    return await choice.delete()
-                result = results[int(msg.content) - 1]
-            embed = Embed(color=Color.dark_purple(), title=result['name'], url='https://sv.bagoum.com/cards/{}'.format(result['id']))
-            race = result['faction'] if not result['race'] else '{}/{}'.format(result['faction'], result['race'])
-            embed.set_thumbnail(url='https://sv.bagoum.com/cardF/en/c/{}'.format(result['id']))
-            embed.set_image(url='https://sv.bagoum.com/getRawImage/0/0/{}'.format(result['id']))
-            embed.add_field(name='Класс', value=race, inline=False)
-            embed.add_field(name='Дополнение', value=result['expansion'], inline=False)
-            if result['baseData']['description']:
-                embed.add_field(name='Описание', value=result['baseData']['description'].replace('<br>', '\n'), inline=False)
-            embed.add_field(name='Flair', value=result['baseData']['flair'].replace('<br>', '\n'), inline=False)
-            if result['hasEvo']:
-                evoembed = Embed(color=Color.dark_purple(), title=result['name'] + ' (evolved)',
-                                 url='https://sv.bagoum.com/cards/{}'.format(result['id']))
-                evoembed.set_thumbnail(url='https://sv.bagoum.com/cardF/en/e/{}'.format(result['id']))
-                evoembed.set_image(url='https://sv.bagoum.com/getRawImage/1/0/{}'.format(result['id']))
-                if result['evoData']['description']:
-                    evoembed.add_field(name='Описание', value=result['evoData']['description'].replace('<br>', '\n'), inline=False)
-                elif result['baseData']['description']:
-                    evoembed.add_field(name='Описание', value=result['baseData']['description'].replace('<br>', '\n'), inline=False)
-                evoembed.add_field(name='Flair', value=result['evoData']['flair'].replace('<br>', '\n'), inline=False)
-                await ctx.send(embed=embed)
-                return await ctx.send(embed=evoembed)
-            return await ctx.send(embed=embed)
+    @command(name='svcard', help='Команда для поиска карты из Shadowverse', usage='svcard <запрос>')
+    async def svcard_(self, ctx, *, search):
+        result = await self.choose_card(ctx, search)
+        if result is None:
+            return
+        embed = Embed(color=Color.dark_purple(), title=result['name'], url='https://sv.bagoum.com/cards/{}'.format(result['id']))
+        race = result['faction'] if not result['race'] else '{}/{}'.format(result['faction'], result['race'])
+        embed.set_thumbnail(url='https://sv.bagoum.com/cardF/en/c/{}'.format(result['id']))
+        embed.set_image(url='https://sv.bagoum.com/getRawImage/0/0/{}'.format(result['id']))
+        embed.add_field(name='Класс', value=race, inline=False)
+        embed.add_field(name='Дополнение', value=result['expansion'], inline=False)
+        if result['baseData']['description']:
+            embed.add_field(name='Описание', value=result['baseData']['description'].replace('<br>', '\n'), inline=False)
+        embed.add_field(name='Flair', value=result['baseData']['flair'].replace('<br>', '\n'), inline=False)
+        if result['hasEvo']:
+            evoembed = Embed(color=Color.dark_purple(), title=result['name'] + ' (evolved)',
+                             url='https://sv.bagoum.com/cards/{}'.format(result['id']))
+            evoembed.set_thumbnail(url='https://sv.bagoum.com/cardF/en/e/{}'.format(result['id']))
+            evoembed.set_image(url='https://sv.bagoum.com/getRawImage/1/0/{}'.format(result['id']))
+            if result['evoData']['description']:
+                evoembed.add_field(name='Описание', value=result['evoData']['description'].replace('<br>', '\n'), inline=False)
+            elif result['baseData']['description']:
+                evoembed.add_field(name='Описание', value=result['baseData']['description'].replace('<br>', '\n'), inline=False)
+            evoembed.add_field(name='Flair', value=result['evoData']['flair'].replace('<br>', '\n'), inline=False)
+            await ctx.send(embed=embed)
+            return await ctx.send(embed=evoembed)
+        return await ctx.send(embed=embed)
 
     @command(name='svart', help='Команда для поиска арта карты из Shadowverse',
              usage='svart <запрос>')
     async def svart_(self, ctx, *, search):
-        cards = self.cards
-        results = []
-        if not isinstance(cards, dict):
-            return await ctx.send(f'Не удалось получить список карт. Попробуйте использовать {ctx.prefix}svupdate')
-        text_channel = ctx.message.channel
-        user = ctx.message.author
-        terms = search.split(' ')
-        for card in cards:
-            if all(term.lower() in cards[card]['searchableText'].lower() for term in terms):
-                results.append(cards[card])
-                if len(results) == 10:
-                    break
-        if not results:
-            return await ctx.send('Карты не найдены')
-        else:
-            if len(results) == 1:
-                result = results[0]
-            else:
-                content = ''
-                for i in range(len(results)):
-                    content += '{}. {}\n'.format(i + 1, results[i]['name'])
-                embed = Embed(color=Color.dark_purple(), title='Выберите карту', description=content)
-                embed.set_footer(text='Автоматическая отмена через 30 секунд\nОтправьте 0 для отмены')
-                choice = await ctx.send(embed=embed)
-                canc = False
-                prefixes = await self.bot.get_prefix(ctx.message)
-
-                def verify(m):
-                    nonlocal canc
-                    if m.content.isdigit():
-                        return 0 <= int(m.content) <= len(results) and m.channel == text_channel and m.author == user
-                    canc = m.channel == text_channel and m.author == user and any(m.content.startswith(prefix) and len(m.content) > len(prefix) for prefix in prefixes)
-                    return canc
-
-                msg = await self.bot.wait_for('message', check=verify, timeout=30)
-                if canc:
-                    return await choice.delete()
-                if int(msg.content) == 0:
-                    return await choice.delete()
-                result = results[int(msg.content) - 1]
-            embed = Embed(color=Color.dark_purple(), title=result['name'], url='https://sv.bagoum.com/cards/{}'.format(result['id']))
-            embed.set_image(url='https://sv.bagoum.com/getRawImage/0/0/{}'.format(result['id']))
-            if result['hasEvo']:
-                evoembed = Embed(color=Color.dark_purple(), title=result['name'] + ' (evolved)',
-                                 url='https://sv.bagoum.com/cards/{}'.format(result['id']))
-                evoembed.set_image(url='https://sv.bagoum.com/getRawImage/1/0/{}'.format(result['id']))
-                await ctx.send(embed=embed)
-                return await ctx.send(embed=evoembed)
-            return await ctx.send(embed=embed)
+        result = await self.choose_card(ctx, search)
+        if result is None:
+            return
+        embed = Embed(color=Color.dark_purple(), title=result['name'], url='https://sv.bagoum.com/cards/{}'.format(result['id']))
+        embed.set_image(url='https://sv.bagoum.com/getRawImage/0/0/{}'.format(result['id']))
+        if result['hasEvo']:
+            evoembed = Embed(color=Color.dark_purple(), title=result['name'] + ' (evolved)',
+                             url='https://sv.bagoum.com/cards/{}'.format(result['id']))
+            evoembed.set_image(url='https://sv.bagoum.com/getRawImage/1/0/{}'.format(result['id']))
+            await ctx.send(embed=embed)
+            return await ctx.send(embed=evoembed)
+        return await ctx.send(embed=embed)
 
     @command(name='svupdate', help='Команда для обновления базы данных карт')
     async def update_(self, ctx):
         try:
-            async with ClientSession() as client:
-                cards = await client.get('https://sv.bagoum.com/cardsFullJSON')
-                self.cards = await cards.json()
+            await self.load_cards()
             return await ctx.send('База данных карт успешно обновлена')
         except Exception as e:
             return await ctx.send('При обновлении базы данных карт произошла ошибка. Подробнее:\n{}'.format(e))
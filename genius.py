@@ -0,0 +1,108 @@
+from asyncio import get_event_loop
+from html.parser import HTMLParser
+from textwrap import wrap
+
+from credentials import genius_token
+
+from cache import TTLCache, DiskCache
+from http_client import http
+
+
+class LyricsParser(HTMLParser):
+    """
+    Текст первого абзаца страницы песни, разбор прекращается после его закрытия
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.depth = 0
+        self.done = False
+        self.parts = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'p' and not self.done:
+            self.depth += 1
+
+    def handle_endtag(self, tag):
+        if tag == 'p' and self.depth:
+            self.depth -= 1
+            self.done = not self.depth
+
+    def handle_data(self, data):
+        if self.depth:
+            self.parts.append(data)
+
+    @property
+    def text(self):
+        return ''.join(self.parts)
+
+
+def extract_lyrics(html, chunk_size=65536):
+    parser = LyricsParser()
+    for start in range(0, len(html), chunk_size):
+        parser.feed(html[start:start + chunk_size])
+        if parser.done:
+            break
+    return parser.text
+
+
+def paginate(text, size=2000):
+    pages = []
+    page = ''
+    for line in text.split('\n'):
+        for part in wrap(line, size) if len(line) > size else [line]:
+            if page and len(page) + len(part) + 1 > size:
+                pages.append(page)
+                page = ''
+            page += part + '\n'
+    if page.strip():
+        pages.append(page)
+    return pages
+
+
+class Genius:
+    """
+    Поиск песен на Genius и кэш текстов по id песни, разбитых на страницы для эмбедов
+    """
+
+    def __init__(self, token, page_size=2000):
+        self.headers = {'Authorization': 'Bearer ' + token}
+        self.page_size = page_size
+        self.searches = TTLCache('genius_search', maxsize=256, ttl=3600)
+        self.memory = TTLCache('lyrics', maxsize=256, ttl=86400)
+        self.disk = DiskCache('lyrics', ttl=30 * 86400)
+
+    @staticmethod
+    def title(song):
+        return f'{song["primary_artist"]["name"]} - {song["title"]}'
+
+    @staticmethod
+    def complete(hit):
+        return hit['type'] == 'song' and hit['result']['lyrics_state'] == 'complete'
+
+    async def _search(self, query):
+        res = await http.get_json('https://api.genius.com/search', params={'q': query}, headers=self.headers)
+        return res['response']['hits']
+
+    async def search(self, query):
+        return await self.searches.get_or_load(query.lower().strip(), lambda: self._search(query))
+
+    def _extract(self, html):
+        text = extract_lyrics(html)
+        return {'length': len(text), 'pages': paginate(text, self.page_size)}
+
+    async def _fetch(self, song):
+        entry = await self.disk.get(song['id'])
+        if entry is not None:
+            return entry
+        html = await http.get_text(song['url'])
+        entry = await get_event_loop().run_in_executor(None, self._extract, html)
+        if entry['pages']:
+            await self.disk.set(song['id'], entry)
+        return entry
+
+    async def lyrics(self, song):
+        return await self.memory.get_or_load(song['id'], lambda: self._fetch(song), negative=lambda entry: not entry['pages'])
+
+
+genius = Genius(genius_token)
@@ -0,0 +1,52 @@
+from asyncio import get_event_loop
+from json import load, dump
+from os import replace
+from threading import Lock
+
+from credentials import dev
+from discord.ext.commands import when_mentioned_or
+
+
+class GuildConfig:
+    def __init__(self, prefixes_path='resources/prefixes.json', default_prefix='?'):
+        self.prefixes_path = prefixes_path
+        self.default_prefix = default_prefix
+        self._lock = Lock()
+        self._resolvers = {}
+        self._version = 0
+        self._saved_version = 0
+        with open(prefixes_path, 'r') as f:
+            self.prefixes = load(f)
+
+    def get_prefix(self, dest_id):
+        return self.prefixes.get(str(dest_id), self.default_prefix)
+
+    def resolver(self, pr):
+        resolver = self._resolvers.get(pr)
+        if resolver is None:
+            resolver = self._resolvers[pr] = when_mentioned_or(pr)
+        return resolver
+
+    def set_prefix(self, dest_id, pr):
+        self.prefixes[str(dest_id)] = pr
+        self._version += 1
+        return get_event_loop().run_in_executor(None, self._save, dict(self.prefixes), self._version)
+
+    def _save(self, snapshot, version):
+        with self._lock:
+            if version < self._saved_version:
+                return
+            self._saved_version = version
+            tmp = self.prefixes_path + '.tmp'
+            with open(tmp, 'w') as f:
+                dump(snapshot, f)
+            replace(tmp, self.prefixes_path)
+
+
+guild_config = GuildConfig()
+
+
+def prefix(dbot, msg):
+    destid = msg.guild.id if msg.guild else msg.author.id
+    pr = 'r?' if dev else guild_config.get_prefix(destid)
+    return guild_config.resolver(pr)(dbot, msg)
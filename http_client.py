@@ -0,0 +1,84 @@
+from asyncio import sleep, TimeoutError
+from time import monotonic
+from urllib.parse import urlsplit
+
+from aiohttp import ClientSession, TCPConnector, ClientTimeout, ClientError
+
+from metrics import metrics
+
+
+class RetryableStatus(Exception):
+    def __init__(self, status):
+        super().__init__(f'HTTP {status}')
+        self.status = status
+
+
+class HttpClient:
+    """
+    Общая сессия aiohttp с пулом соединений и повторами GET-запросов; задержки по хостам пишутся в metrics
+    """
+    idempotent = ('GET', 'HEAD', 'OPTIONS')
+
+    def __init__(self, limit=100, limit_per_host=10, dns_ttl=300, keepalive=30, timeout=10, retries=2, backoff=0.5):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_ttl = dns_ttl
+        self.keepalive = keepalive
+        self.timeout = ClientTimeout(total=timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self._session = None
+
+    @property
+    def session(self):
+        if self._session is None or self._session.closed:
+            connector = TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host, ttl_dns_cache=self.dns_ttl,
+                                     keepalive_timeout=self.keepalive)
+            self._session = ClientSession(connector=connector, timeout=self.timeout)
+        return self._session
+
+    async def request(self, method, url, read='json', retries=None, **kwargs):
+        timeout = kwargs.get('timeout')
+        if timeout is not None and not isinstance(timeout, ClientTimeout):
+            kwargs['timeout'] = ClientTimeout(total=timeout)
+        host = urlsplit(str(url)).hostname
+        if retries is None:
+            retries = self.retries
+        attempts = retries + 1 if method in self.idempotent else 1
+        for attempt in range(attempts):
+            started = monotonic()
+            try:
+                async with self.session.request(method, url, **kwargs) as r:
+                    if r.status >= 500 and attempt < attempts - 1:
+                        raise RetryableStatus(r.status)
+                    if read == 'json':
+                        body = await r.json(content_type=None)
+                    elif read == 'text':
+                        body = await r.text()
+                    else:
+                        body = await r.read()
+            except (ClientError, TimeoutError, RetryableStatus):
+                metrics.observe('http', host, monotonic() - started, True)
+                if attempt == attempts - 1:
+                    raise
+                metrics.retry('http', host)
+                await sleep(self.backoff * 2 ** attempt)
+            else:
+                metrics.observe('http', host, monotonic() - started)
+                return body
+
+    async def get_json(self, url, **kwargs):
+        return await self.request('GET', url, **kwargs)
+
+    async def get_text(self, url, **kwargs):
+        return await self.request('GET', url, read='text', **kwargs)
+
+    async def post_json(self, url, **kwargs):
+        return await self.request('POST', url, **kwargs)
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+
+http = HttpClient()
@@ -0,0 +1,68 @@
+from sortedcontainers import SortedList
+
+
+class Leaderboard:
+    """
+    Упорядоченный топ печенек: глобальный и по серверам
+    """
+
+    def __init__(self):
+        self.keys = {}
+        self.order = SortedList()
+        self.guilds = {}
+        self.user_guilds = {}
+
+    def update(self, user_id, cookies):
+        key = (-cookies, user_id)
+        old = self.keys.get(user_id)
+        if old == key:
+            return
+        self.keys[user_id] = key
+        if old is not None:
+            self.order.remove(old)
+        self.order.add(key)
+        for guild_id in self.user_guilds.get(user_id, ()):
+            board = self.guilds[guild_id]
+            if old is not None:
+                board.remove(old)
+            board.add(key)
+
+    def join(self, guild_id, user_id):
+        guilds = self.user_guilds.setdefault(user_id, set())
+        if guild_id in guilds:
+            return
+        guilds.add(guild_id)
+        board = self.guilds.setdefault(guild_id, SortedList())
+        if user_id in self.keys:
+            board.add(self.keys[user_id])
+
+    def leave(self, guild_id, user_id):
+        guilds = self.user_guilds.get(user_id)
+        if not guilds or guild_id not in guilds:
+            return
+        guilds.discard(guild_id)
+        if user_id in self.keys:
+            self.guilds[guild_id].discard(self.keys[user_id])
+
+    def remove_guild(self, guild_id):
+        self.guilds.pop(guild_id, None)
+        for guilds in self.user_guilds.values():
+            guilds.discard(guild_id)
+
+    def board(self, guild_id=None):
+        if guild_id is None:
+            return self.order
+        return self.guilds.get(guild_id, ())
+
+    def top(self, amount, guild_id=None, start=0):
+        board = self.board(guild_id)
+        return [key[1] for key in board[start:start + amount]]
+
+    def rank(self, user_id, guild_id=None):
+        key = self.keys.get(user_id)
+        if key is None or (guild_id is not None and guild_id not in self.user_guilds.get(user_id, ())):
+            return None
+        return self.board(guild_id).index(key)
+
+    def size(self, guild_id=None):
+        return len(self.board(guild_id))
@@ -0,0 +1,182 @@
+import sqlite3
+from asyncio import sleep, get_event_loop
+from json import load
+from os import path
+from threading import Lock
+
+from leaderboard import Leaderboard
+
+
+class WalletError(Exception):
+    pass
+
+
+class Escrow:
+    """
+    Ставки одной игры: резервируются в памяти и списываются одной операцией при расчете
+    """
+
+    def __init__(self, ledger, user_id):
+        self.ledger = ledger
+        self.user_id = user_id
+        self.amount = 0
+        self.payout = 0
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self.closed:
+            self.commit()
+
+    @property
+    def balance(self):
+        return self.ledger.get(self.user_id) - self.amount + self.payout
+
+    def reserve(self, amt):
+        if self.closed:
+            raise WalletError('Игра уже завершена')
+        if amt > self.ledger.available(self.user_id):
+            raise WalletError('Недостаточно печенек')
+        self.amount += amt
+        self.ledger.held[self.user_id] = self.ledger.held.get(self.user_id, 0) + amt
+
+    def pay(self, amt):
+        self.payout += amt
+
+    def _close(self):
+        if self.closed:
+            raise WalletError('Игра уже завершена')
+        self.closed = True
+        held = self.ledger.held.get(self.user_id, 0) - self.amount
+        if held:
+            self.ledger.held[self.user_id] = held
+        else:
+            self.ledger.held.pop(self.user_id, None)
+        games = self.ledger.games[self.user_id] - 1
+        if games:
+            self.ledger.games[self.user_id] = games
+        else:
+            del self.ledger.games[self.user_id]
+
+    def commit(self):
+        self._close()
+        if self.payout != self.amount:
+            self.ledger.add(self.user_id, self.payout - self.amount)
+
+    def release(self):
+        self._close()
+
+
+class Ledger:
+    """
+    Балансы печенек в памяти с отложенной записью в SQLite
+    """
+
+    def __init__(self, db_path='resources/cookies.db', legacy_path='resources/cookies.json', flush_interval=30, max_games=1):
+        self.flush_interval = flush_interval
+        self.max_games = max_games
+        self.accounts = {}
+        self.held = {}
+        self.games = {}
+        self.board = Leaderboard()
+        self._dirty = set()
+        self._lock = Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS cookies (id INTEGER PRIMARY KEY, name TEXT NOT NULL, cookies INTEGER NOT NULL)')
+        self._db.commit()
+        for user_id, name, cookies in self._db.execute('SELECT id, name, cookies FROM cookies'):
+            self.accounts[user_id] = {'id': user_id, 'name': name, 'cookies': cookies}
+            self.board.update(user_id, cookies)
+        if not self.accounts and path.exists(legacy_path):
+            self._import_json(legacy_path)
+
+    def _import_json(self, legacy_path):
+        with open(legacy_path, 'r') as f:
+            legacy = load(f)
+        for user_id, account in legacy.items():
+            user_id = int(user_id)
+            self.accounts[user_id] = {'id': user_id, 'name': account['name'], 'cookies': account['cookies']}
+            self.board.update(user_id, account['cookies'])
+            self._dirty.add(user_id)
+        self._write()
+        print(f'Imported {len(legacy)} cookie accounts from {legacy_path}')
+
+    def __contains__(self, user_id):
+        return int(user_id) in self.accounts
+
+    def __len__(self):
+        return len(self.accounts)
+
+    def get(self, user_id):
+        account = self.accounts.get(int(user_id))
+        if account is None:
+            return None
+        return account['cookies']
+
+    def available(self, user_id):
+        user_id = int(user_id)
+        return self.accounts[user_id]['cookies'] - self.held.get(user_id, 0)
+
+    def escrow(self, user_id):
+        user_id = int(user_id)
+        if user_id not in self.accounts:
+            raise WalletError('У вас нет печенек')
+        if self.games.get(user_id, 0) >= self.max_games:
+            raise WalletError('У вас уже идет игра')
+        self.games[user_id] = self.games.get(user_id, 0) + 1
+        return Escrow(self, user_id)
+
+    def open(self, user_id, name, cookies):
+        user_id = int(user_id)
+        if user_id in self.accounts:
+            return False
+        self.accounts[user_id] = {'id': user_id, 'name': name, 'cookies': cookies}
+        self.board.update(user_id, cookies)
+        self._dirty.add(user_id)
+        return True
+
+    def add(self, user_id, amt):
+        user_id = int(user_id)
+        account = self.accounts[user_id]
+        account['cookies'] += amt
+        self.board.update(user_id, account['cookies'])
+        self._dirty.add(user_id)
+
+    def _take(self):
+        dirty, self._dirty = self._dirty, set()
+        return [(user_id, self.accounts[user_id]['name'], self.accounts[user_id]['cookies']) for user_id in dirty]
+
+    def _store(self, rows):
+        with self._lock, self._db:
+            self._db.executemany('INSERT OR REPLACE INTO cookies (id, name, cookies) VALUES (?, ?, ?)', rows)
+
+    def _write(self):
+        rows = self._take()
+        if rows:
+            self._store(rows)
+
+    async def flush(self):
+        rows = self._take()
+        if not rows:
+            return
+        try:
+            await get_event_loop().run_in_executor(None, self._store, rows)
+        except Exception:
+            self._dirty.update(row[0] for row in rows)
+            raise
+
+    async def run(self):
+        while True:
+            await sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f'Exception in ledger flush:\n{e}')
+
+    def close(self):
+        self._write()
+        self._db.close()
@@ -2,27 +2,32 @@ from traceback import print_exception
 
 from credentials import discord_status, discord_bot_token, discord_alpha_token
 from discord import ClientException
-from discord.ext.commands import when_mentioned_or, MissingRequiredArgument, BadArgument
+from discord.ext.commands import MissingRequiredArgument, BadArgument
 
 from check import *
 from cookies import *
 from games import *
+from guild_config import prefix
+from http_client import http
+from metrics import metrics
 from misc import *
 from moderation import *
 from music import *
 
-default_prefix = '?'
 
+class RaccoonBot(Bot):
+    async def close(self):
+        if self.is_closed():
+            return
+        await super().close()
+        await http.close()
+        await metrics.close()
+        ledger.close()
 
-def prefix(dbot, msg):
-    destid = str(msg.guild.id) if msg.guild else str(msg.author.id)
-    prefixes = load(open('resources/prefixes.json', 'r'))
-    pr = 'r?' if dev else prefixes.get(destid, default_prefix)
-    return when_mentioned_or(pr)(dbot, msg)
 
-
-bot = Bot(command_prefix=prefix, description='Cutest bot on Discord (subjective)', case_insensitive=True)
+bot = RaccoonBot(command_prefix=prefix, description='Cutest bot on Discord (subjective)', case_insensitive=True)
 bot.remove_command('help')
+metrics.instrument_discord(bot.http)
 
 
 async def change_status():
@@ -43,6 +48,8 @@ async def change_status():
 @bot.event
 async def on_ready():
     bot.loop.create_task(change_status())
+    bot.loop.create_task(resource_cache.watch())
+    bot.loop.create_task(metrics.serve())
     try:
         misc_setup(bot)
         music_setup(bot)
@@ -52,7 +59,7 @@ async def on_ready():
     except ClientException:
         pass
     if not dev:
-        await check(bot)
+        print(str(await check(bot)).splitlines()[-1])
     print('Logged on as', bot.user)
 
 
@@ -87,11 +94,15 @@ async def on_raw_reaction_remove(payload):
             pass
 
 
-@bot.command(name='update', pass_context=True, hidden=True)
-async def update(ctx):
+@bot.command(name='update', pass_context=True, hidden=True, usage='update [dry]')
+async def update(ctx, mode=None):
     try:
         if ctx.author.id == discord_pers_id:
-            await check(bot)
+            result = await check(bot, dry_run=mode == 'dry')
+            report = str(result)
+            if len(report) > 1900:
+                report = '...\n' + report[-1900:]
+            await ctx.send(f'```{report}```')
             await ctx.message.add_reaction('👌')
     except Exception as e:
         await ctx.send('Ошибка: \n {}'.format(e))
@@ -129,8 +140,19 @@ async def help_(ctx, request=None):
         await ctx.send('Ошибка: \n {}'.format(e))
 
 
+@bot.listen()
+async def on_command(ctx):
+    metrics.command_started(ctx)
+
+
+@bot.listen()
+async def on_command_completion(ctx):
+    metrics.command_finished(ctx)
+
+
 @bot.listen()
 async def on_command_error(ctx, error):
+    metrics.command_finished(ctx, error)
     if isinstance(error, MissingRequiredArgument):
         return await ctx.send(f'Использование: {ctx.prefix}{ctx.command.usage or ctx.command.name}')
     elif isinstance(error, BadArgument):
@@ -0,0 +1,160 @@
+from bisect import bisect_left
+from collections import defaultdict
+from time import monotonic
+
+from aiohttp import web
+
+default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, float('inf'))
+
+
+def label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def bound(value):
+    return '+Inf' if value == float('inf') else repr(value)
+
+
+class Histogram:
+    def __init__(self, buckets=default_buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value, error=False):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.errors += error
+        self.total += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for le, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return le
+        return self.buckets[-1]
+
+    def cumulative(self):
+        cumulative = 0
+        for le, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield le, cumulative
+
+    @property
+    def avg(self):
+        return self.total / self.count if self.count else 0.0
+
+    def __str__(self):
+        return (f'{self.count} вызовов, {self.errors} ошибок, avg {self.avg * 1000:.0f}ms, max {self.max * 1000:.0f}ms, '
+                f'p50 ≤{bound(self.quantile(0.5))}s, p99 ≤{bound(self.quantile(0.99))}s')
+
+
+class Metrics:
+    """
+    Задержки и ошибки команд, фоновых циклов, HTTP-запросов по хостам и запросов к Discord по маршрутам
+    """
+    namespace = 'raccoonbot'
+
+    def __init__(self):
+        self.commands = defaultdict(Histogram)
+        self.in_flight = defaultdict(int)
+        self.timings = defaultdict(lambda: defaultdict(Histogram))
+        self.retries = defaultdict(lambda: defaultdict(int))
+        self._runner = None
+
+    def command_started(self, ctx):
+        ctx.metrics_started = monotonic()
+        self.in_flight[ctx.command.qualified_name] += 1
+
+    def command_finished(self, ctx, error=None):
+        started = getattr(ctx, 'metrics_started', None)
+        if started is None or ctx.command is None:
+            return
+        ctx.metrics_started = None
+        name = ctx.command.qualified_name
+        self.in_flight[name] -= 1
+        self.commands[name].observe(monotonic() - started, error is not None)
+
+    def observe(self, kind, target, seconds, error=False):
+        self.timings[kind][target].observe(seconds, error)
+
+    def retry(self, kind, target):
+        self.retries[kind][target] += 1
+
+    def instrument_discord(self, client_http):
+        request = client_http.request
+
+        async def timed_request(route, **kwargs):
+            started = monotonic()
+            error = False
+            try:
+                return await request(route, **kwargs)
+            except Exception:
+                error = True
+                raise
+            finally:
+                self.observe('discord', f'{route.method} {route.path}', monotonic() - started, error)
+
+        client_http.request = timed_request
+
+    def _histogram(self, name, labels, histogram):
+        lines = []
+        for le, count in histogram.cumulative():
+            lines.append(f'{name}_bucket{{{labels},le="{bound(le)}"}} {count}')
+        lines.append(f'{name}_sum{{{labels}}} {histogram.total}')
+        lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+        return lines
+
+    def render(self):
+        ns = self.namespace
+        lines = [f'# TYPE {ns}_command_seconds histogram']
+        for name, histogram in sorted(self.commands.items()):
+            lines += self._histogram(f'{ns}_command_seconds', f'command="{label(name)}"', histogram)
+        lines.append(f'# TYPE {ns}_command_errors_total counter')
+        lines += [f'{ns}_command_errors_total{{command="{label(name)}"}} {histogram.errors}' for name, histogram in sorted(self.commands.items())]
+        lines.append(f'# TYPE {ns}_command_in_flight gauge')
+        lines += [f'{ns}_command_in_flight{{command="{label(name)}"}} {count}' for name, count in sorted(self.in_flight.items())]
+        lines.append(f'# TYPE {ns}_request_seconds histogram')
+        for kind, targets in sorted(self.timings.items()):
+            for target, histogram in sorted(targets.items()):
+                lines += self._histogram(f'{ns}_request_seconds', f'kind="{label(kind)}",target="{label(target)}"', histogram)
+        lines.append(f'# TYPE {ns}_request_errors_total counter')
+        for kind, targets in sorted(self.timings.items()):
+            lines += [f'{ns}_request_errors_total{{kind="{label(kind)}",target="{label(target)}"}} {histogram.errors}'
+                      for target, histogram in sorted(targets.items())]
+        lines.append(f'# TYPE {ns}_request_retries_total counter')
+        for kind, targets in sorted(self.retries.items()):
+            lines += [f'{ns}_request_retries_total{{kind="{label(kind)}",target="{label(target)}"}} {count}'
+                      for target, count in sorted(targets.items())]
+        return '\n'.join(lines) + '\n'
+
+    async def handle(self, request):
+        return web.Response(text=self.render(), content_type='text/plain', charset='utf-8')
+
+    async def serve(self, host='127.0.0.1', port=9123):
+        if self._runner is not None:
+            return
+        app = web.Application()
+        app.router.add_get('/metrics', self.handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        try:
+            await web.TCPSite(self._runner, host, port).start()
+        except OSError as e:
+            print(f'Failed to start metrics endpoint on {host}:{port}: {e}')
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+metrics = Metrics()
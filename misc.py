@@ -1,62 +1,36 @@
 import locale
-from asyncio import sleep
 from datetime import datetime
-from html import unescape
-from json import dump
-from json import load
-from os import getcwd
-from random import choice
-from time import time, gmtime, strftime
 
 import regex as re
-from aiohttp import ClientSession, ClientProxyConnectionError, ServerTimeoutError
+from aiohttp import ClientSession, ClientProxyConnectionError
 from aiohttp_socks import ProxyConnector
-from bs4 import BeautifulSoup
-from credentials import genius_token, shiki_client_id, shiki_client_secret
 from discord import Embed, Color
 from discord.ext.commands import Cog, command, Bot
-from git import Repo
 
-locale.setlocale(locale.LC_ALL, 'ru_RU.utf8')
-
-
-async def shiki_refresh(rt):
-    payload = {
-        'grant_type': 'refresh_token',
-        'client_id': shiki_client_id,
-        'client_secret': shiki_client_secret,
-        'refresh_token': rt
-    }
-    headers = {
-        'User-Agent': 'RaccoonBot'
-    }
-    async with ClientSession() as client:
-        req = await client.post('https://shikimori.one/oauth/token', data=payload, headers=headers)
-        req = await req.json()
-    dump(req, open('resources/shiki.json', 'w+'))
+from changelog import changelog
+from fandom import fandom, FandomError
+from genius import genius
+from resource_cache import resource_cache
+from shikimori import shikimori, ShikimoriError
 
+locale.setlocale(locale.LC_ALL, 'ru_RU.utf8')
 
-async def refresh_shiki_token():
-    while True:
-        auth = load(open('resources/shiki.json', 'r+'))
-        if time() - 3800 > auth['created_at'] + auth['expires_in']:
-            await shiki_refresh(auth['refresh_token'])
-        await sleep(3600)
+raccoons = resource_cache.register('raccoons', 'resources/raccoons.txt')
+facts = resource_cache.register('facts', 'resources/facts.json')
 
 
 class Misc(Cog):
     def __init__(self, bot: Bot):
         self.bot = bot
-        self.bot.loop.create_task(refresh_shiki_token())
+        self.bot.loop.create_task(shikimori.refresh_loop())
+        self.bot.loop.create_task(changelog.refresh())
 
     @command(name='raccoon', aliases=['racc'], help='Команда, которая сделает вашу жизнь лучше')
     async def raccoon_(self, ctx, *, msg=None):
         user = ctx.author
         if msg is None:
             msg = user.mention
-        with open('resources/raccoons.txt', 'r') as f:
-            raccoons = load(f)
-            raccoon = choice(raccoons)
+        raccoon = raccoons.choice()
         embed = Embed(color=Color.dark_purple())
         embed.set_image(url=raccoon)
         return await ctx.send(msg, embed=embed)
@@ -82,12 +56,17 @@ class Misc(Cog):
         user = ctx.author
         if msg is None:
             msg = user.mention
-        with open('resources/facts.json', 'r') as f:
-            facts = load(f)
-            fact = choice(facts)
+        fact = facts.choice()
         embed = Embed(color=Color.dark_purple(), description=fact)
         return await ctx.send(msg, embed=embed)
 
+    @staticmethod
+    def article_embed(article):
+        embed = Embed(color=Color.dark_purple(), title=article['title'], url=article['url'], description=article['description'])
+        if article['thumbnail'] is not None:
+            embed.set_thumbnail(url=article['thumbnail'])
+        return embed
+
     @command(name='wikia', aliases=['wiki'], help='Команда для поиска статей на Fandom\nКриво работает, лучше использовать команду fandom',
              usage='wikia <запрос>')
     async def wikia_(self, ctx, *, query=None):
@@ -95,31 +74,11 @@ class Misc(Cog):
             text_channel = ctx.message.channel
             if query is None:
                 return await ctx.send(f'Использование: {ctx.prefix}[wikia|wiki] <запрос>')
-            apiurl = 'https://community.fandom.com/api/v1/Search/CrossWiki'
             user = ctx.message.author
-            params = {
-                'expand': 1,
-                'query': query,
-                'lang': 'ru,en',
-                'limit': 10,
-                'batch': 1,
-                'rank': 'default'
-            }
-            async with ClientSession() as client:
-                result = await client.get(apiurl, params=params, timeout=0.5)
-                result = await result.json()
-            if 'exception' in result.keys():
+            new_results = await fandom.wikis(query, ('ru,en',))
+            if not new_results:
                 return await ctx.send('Ничего не найдено')
-            results = result['items']
-            new_results = []
-            embedValue = ''
-            i = 0
-            for result in results:
-                if result:
-                    if result['title']:
-                        i += 1
-                        embedValue += '{}. {}\n'.format(i, result['title'])
-                        new_results.append(result)
+            embedValue = ''.join('{}. {}\n'.format(i + 1, result['title']) for i, result in enumerate(new_results))
             embed = Embed(color=Color.dark_purple(), title='Выберите фэндом', description=embedValue)
             embed.set_footer(text='Автоматическая отмена через 30 секунд\nОтправьте 0 для отмены')
             choicemsg = await ctx.send(embed=embed)
@@ -140,72 +99,11 @@ class Misc(Cog):
                 return await choicemsg.delete()
             result = new_results[int(msg.content) - 1]
             await choicemsg.delete()
-            if result['url'].endswith('/'):
-                apiurl = '{}api/v1/'.format(result['url'])
-            else:
-                apiurl = '{}/api/v1/'.format(result['url'])
-            params = {
-                'query': query,
-                'namespaces': '0,14',
-                'limit': 1,
-                'minArticleQuality': 0,
-                'batch': 1
-            }
-            try:
-                async with ClientSession() as client:
-                    result = await client.get(apiurl + 'Search/List', params=params, timeout=0.5)
-                    result = await result.json()
-            except Exception as e:
-                await ctx.send('Ничего не найдено')
-                return print(e)
-            if 'exception' in result.keys():
+            article = await fandom.article(result['url'], query)
+            if article is None:
                 return await ctx.send('Ничего не найдено')
-            page_id = result['items'][0]['id']
-            params = {
-                'ids': page_id,
-                'abstract': 500,
-                'width': 200,
-                'height': 200
-            }
-            async with ClientSession() as client:
-                result = await client.get(apiurl + 'Articles/Details', params=params, timeout=0.5)
-                result = await result.json()
-            basepath = result['basepath']
-            result = result['items'][str(page_id)]
-            page_url = basepath + result['url']
-            title = result['title']
-            desc = unescape(result['abstract'])
-            dims = result['original_dimensions']
-            thumb = result['thumbnail']
-            if dims is not None:
-                width = dims['width']
-                height = dims['height']
-                if width <= 200:
-                    params = {
-                        'ids': page_id,
-                        'abstract': 0,
-                        'width': int(width),
-                        'height': int(height)
-                    }
-                else:
-                    ratio = height / width
-                    width = 200
-                    height = ratio * width
-                    params = {
-                        'ids': page_id,
-                        'abstract': 0,
-                        'width': int(width),
-                        'height': int(height)
-                    }
-                async with ClientSession() as client:
-                    result = await client.get(apiurl + 'Articles/Details', params=params, timeout=0.5)
-                    result = await result.json()
-                thumb = result['items'][str(page_id)]['thumbnail']
-            embed = Embed(color=Color.dark_purple(), title=title, url=page_url, description=desc)
-            if thumb is not None:
-                embed.set_thumbnail(url=thumb)
-            return await ctx.send(user.mention, embed=embed)
-        except ServerTimeoutError:
+            return await ctx.send(user.mention, embed=self.article_embed(article))
+        except FandomError:
             await ctx.send('Не удалось подключиться к Wikia')
 
     @command(name='fandom', help='Вторая команда для поиска статей на Fandom',
@@ -213,48 +111,11 @@ class Misc(Cog):
     async def fandom_(self, ctx, *, query):
         try:
             text_channel = ctx.message.channel
-            apiurl = 'https://community.fandom.com/api/v1/Search/CrossWiki'
             user = ctx.message.author
-            params = {
-                'expand': 1,
-                'query': query,
-                'lang': 'en',
-                'limit': 10,
-                'batch': 1,
-                'rank': 'default'
-            }
-            async with ClientSession() as client:
-                result = await client.get(apiurl, params=params, timeout=0.5)
-                result = await result.json()
-            if 'exception' in result.keys():
+            new_results = await fandom.wikis(query)
+            if not new_results:
                 return await ctx.send('Ничего не найдено')
-            results = result['items']
-            new_results = []
-            embedValue = ''
-            i = 0
-            for result in results:
-                if result:
-                    if result['title']:
-                        i += 1
-                        embedValue += '{}. {}\n'.format(i, result['title'])
-                        new_results.append(result)
-            if len(new_results) < 10:
-                params['lang'] = 'ru'
-                async with ClientSession() as client:
-                    result = await client.get(apiurl, params=params, timeout=0.5)
-                    result = await result.json()
-                if 'exception' in result.keys():
-                    pass
-                else:
-                    results = result['items']
-                    for result in results:
-                        if i == 10:
-                            break
-                        if result:
-                            if result['title']:
-                                i += 1
-                                embedValue += '{}. {}\n'.format(i, result['title'])
-                                new_results.append(result)
+            embedValue = ''.join('{}. {}\n'.format(i + 1, result['title']) for i, result in enumerate(new_results))
             embed = Embed(color=Color.dark_purple(), title='Выберите фэндом', description=embedValue)
             embed.set_footer(text='Автоматическая отмена через 30 секунд\nОтправьте 0 для отмены')
             choicemsg = await ctx.send(embed=embed)
@@ -275,15 +136,10 @@ class Misc(Cog):
                 return await choicemsg.delete()
             result = new_results[int(msg.content) - 1]
             await choicemsg.delete()
-            if result['url'].endswith('/'):
-                apiurl = '{}api/v1/'.format(result['url'])
-            else:
-                apiurl = '{}/api/v1/'.format(result['url'])
             embed = Embed(color=Color.dark_purple(), title='Введите запрос', description='Отправьте запрос для поска по {}'.format(result['title']))
             embed.set_footer(text='Автоматическая отмена через 60 секунд\nОтправьте 0 для отмены')
             choicemsg = await ctx.send(embed=embed)
             canc = False
-            prefixes = await self.bot.get_prefix(ctx.message)
 
             def verify(m):
                 nonlocal canc
@@ -293,71 +149,12 @@ class Misc(Cog):
             msg = await self.bot.wait_for('message', check=verify, timeout=60)
             if canc:
                 return await choicemsg.delete()
-            query = msg.content
-            params = {
-                'query': query,
-                'namespaces': '0,14',
-                'limit': 1,
-                'minArticleQuality': 0,
-                'batch': 1
-            }
-            try:
-                async with ClientSession() as client:
-                    result = await client.get(apiurl + 'Search/List', params=params, timeout=0.5)
-                    result = await result.json()
-            except Exception as e:
-                embed = Embed(color=Color.dark_purple(), title='Ошибка', description='Ничего не найдено')
-                await choicemsg.edit(embed=embed)
-                return print(e)
-            if 'exception' in result.keys() or result['batches'] == 0:
+            article = await fandom.article(result['url'], msg.content)
+            if article is None:
                 embed = Embed(color=Color.dark_purple(), title='Ошибка', description='Ничего не найдено')
                 return await choicemsg.edit(embed=embed)
-            page_id = result['items'][0]['id']
-            params = {
-                'ids': page_id,
-                'abstract': 500,
-                'width': 200,
-                'height': 200
-            }
-            async with ClientSession() as client:
-                result = await client.get(apiurl + 'Articles/Details', params=params, timeout=0.5)
-                result = await result.json()
-            basepath = result['basepath']
-            result = result['items'][str(page_id)]
-            page_url = basepath + result['url']
-            title = result['title']
-            desc = unescape(result['abstract'])
-            dims = result['original_dimensions']
-            thumb = result['thumbnail']
-            if dims is not None:
-                width = dims['width']
-                height = dims['height']
-                if width <= 200:
-                    params = {
-                        'ids': page_id,
-                        'abstract': 0,
-                        'width': int(width),
-                        'height': int(height)
-                    }
-                else:
-                    ratio = height / width
-                    width = 200
-                    height = ratio * width
-                    params = {
-                        'ids': page_id,
-                        'abstract': 0,
-                        'width': int(width),
-                        'height': int(height)
-                    }
-                async with ClientSession() as client:
-                    result = await client.get(apiurl + 'Articles/Details', params=params, timeout=0.5)
-                    result = await result.json()
-                thumb = result['items'][str(page_id)]['thumbnail']
-            embed = Embed(color=Color.dark_purple(), title=title, url=page_url, description=desc)
-            if thumb is not None:
-                embed.set_thumbnail(url=thumb)
-            return await choicemsg.edit(content=user.mention, embed=embed)
-        except ServerTimeoutError:
+            return await choicemsg.edit(content=user.mention, embed=self.article_embed(article))
+        except FandomError:
             await ctx.send('Не удалось подключиться к Wikia')
 
     @command(aliases=['l'], usage='lyrics <запрос>', help='Команда для поиска текста песен')
@@ -365,16 +162,7 @@ class Misc(Cog):
         text_channel = ctx.message.channel
         user = ctx.message.author
         ftitle = re.sub(r'\[([^)]+?)]', '', re.sub(r'\(([^)]+?)\)', '', title.lower()))
-        params = {
-            'q': ftitle
-        }
-        headers = {
-            'Authorization': 'Bearer ' + genius_token
-        }
-        async with ClientSession() as client:
-            req = await client.get('https://api.genius.com/search', params=params, headers=headers)
-            req = await req.json()
-        r = req['response']['hits']
+        r = await genius.search(ftitle)
         if len(r) == 0:
             return await ctx.send('Песни не найдены')
         else:
@@ -382,10 +170,9 @@ class Misc(Cog):
             embedValue = ''
             i = 0
             for result in r:
-                if result['type'] == 'song' and result['result']['lyrics_state'] == 'complete':
+                if genius.complete(result):
                     i += 1
-                    embedValue += '{}. {} - {}\n'.format(i, result['result']['primary_artist']['name'],
-                                                         result['result']['title'])
+                    embedValue += '{}. {}\n'.format(i, genius.title(result['result']))
                     new_results.append(result)
 
             embed = Embed(color=Color.dark_purple(), title='Выберите трек', description=embedValue)
@@ -407,50 +194,22 @@ class Misc(Cog):
             if int(msg.content) == 0:
                 return await choicemsg.delete()
             result = new_results[int(msg.content) - 1]
-            url = result['result']['url']
-            title = '{} - {}'.format(result['result']['primary_artist']['name'], result['result']['title'])
-            async with ClientSession() as client:
-                lyrics = await client.get(url)
-                lyrics = await lyrics.text()
-            soup = BeautifulSoup(lyrics, 'html.parser')
-            lyrics = soup.p.get_text()
-            if len(lyrics) > 2000:
-                lyrlist = lyrics.split('\n')
-                lyrics = ''
-                it = 1
-                for i in range(len(lyrlist)):
-                    lyrics += lyrlist[i] + '\n'
-                    if i < len(lyrlist) - 1 and len(lyrics + lyrlist[i + 1]) > 2000:
-                        embed = Embed(color=Color.dark_purple(),
-                                      title='Текст {} ({})'.format(title, it), description=lyrics)
-                        await ctx.send(embed=embed)
-                        lyrics = ''
-                        it += 1
-                    elif i == len(lyrlist) - 1:
-                        embed = Embed(color=Color.dark_purple(),
-                                      title='Текст {} ({})'.format(title, it), description=lyrics)
-                        return await ctx.send(embed=embed)
-            else:
-                embed = Embed(color=Color.dark_purple(),
-                              title='Текст ' + title, description=lyrics)
-                return await ctx.send(embed=embed)
+            title = genius.title(result['result'])
+            lyrics = await genius.lyrics(result['result'])
+            pages = lyrics['pages']
+            if not pages:
+                return await ctx.send('Текст песни не найден')
+            for it, page in enumerate(pages):
+                header = 'Текст {} ({})'.format(title, it + 1) if len(pages) > 1 else 'Текст ' + title
+                embed = Embed(color=Color.dark_purple(), title=header, description=page)
+                await ctx.send(embed=embed)
 
     @command(name='shikimori', aliases=['shiki'], usage='shikimori <запрос>', help='Команда для поиска аниме на шикимори')
     async def shiki_(self, ctx, *, query):
-        auth = load(open('resources/shiki.json', 'r'))
-        at = '{token_type} {access_token}'.format(**auth)
-        headers = {
-            'User-Agent': 'RaccoonBot',
-            'Authorization': at
-        }
-        params = {
-            'limit': 10,
-            'search': query,
-            'order': 'popularity'
-        }
-        async with ClientSession() as client:
-            results = await client.get('https://shikimori.one/api/animes', headers=headers, params=params)
-            results = await results.json()
+        try:
+            results = await shikimori.search(query)
+        except ShikimoriError as e:
+            return await ctx.send(str(e))
         embed = Embed(color=Color.dark_purple())
         if not results:
             embed.description = 'Ничего не найдено'
@@ -480,9 +239,7 @@ class Misc(Cog):
             result = results[0]
         title = result['russian'] if result['russian'] else result['name']
         embed = Embed(color=Color.dark_purple(), title=title, url='https://shikimori.one' + result['url'])
-        async with ClientSession() as client:
-            info = await client.get(f'https://shikimori.one/api/animes/{result["id"]}', headers=headers)
-            info = await info.json()
+        info = await shikimori.anime(result['id'])
         embed.set_thumbnail(url='https://shikimori.one' + info['image']['original'])
         if not info['anons']:
             episodes = '{episodes_aired}/{episodes}'.format(**info) if info['ongoing'] else info['episodes']
@@ -523,18 +280,9 @@ class Misc(Cog):
 
     @command(name='changelog', help='Команда, показывающая последние обновления бота')
     async def changelog_(self, ctx):
-        repo = Repo(getcwd())
-        commits = list(repo.iter_commits('master'))
-        cnt = 0
-        unique = []
-        embed = Embed(color=Color.dark_purple(), title='Последние изменения', description='')
-        for commit in commits:
-            if commit.message not in unique:
-                unique.append(commit.message)
-                cnt += 1
-                embed.description += f'\n{strftime("%d-%m-%Y", gmtime(commit.authored_date - commit.author_tz_offset))}: {commit.message.strip()}'
-            if cnt == 20:
-                return await ctx.send(embed=embed)
+        entries = await changelog.get()
+        embed = Embed(color=Color.dark_purple(), title='Последние изменения', description='\n' + '\n'.join(entries))
+        return await ctx.send(embed=embed)
 
 
 def misc_setup(bot):
@@ -1,12 +1,16 @@
-from json import load, dump
 from os import system
 from time import time
 
-from aiohttp import ClientSession
-from credentials import discord_pers_id, shiki_auth_link, shiki_client_id, shiki_client_secret
+from credentials import discord_pers_id, shiki_auth_link
 from discord import VoiceChannel, Embed, Color, Streaming
 from discord.ext.commands import Cog, command, has_permissions, Bot
 
+from cache import caches
+from changelog import changelog
+from guild_config import guild_config
+from metrics import metrics
+from resource_cache import resource_cache
+from shikimori import shikimori
 from utils import sform
 
 
@@ -51,9 +55,7 @@ class Moderation(Cog):
             for pr in prefixes:
                 if sid not in pr:
                     return await ctx.send('Текущий префикс: {}'.format(pr))
-        pfxs = load(open('resources/prefixes.json', 'r'))
-        pfxs[str(ctx.guild.id)] = pref
-        dump(pfxs, open('resources/prefixes.json', 'w'))
+        await guild_config.set_prefix(ctx.guild.id, pref)
         return await ctx.send('Префикс установлен на {}'.format(pref))
 
     @command(name='ping', pass_context=True, help='Команда для проверки жизнеспособности бота')
@@ -65,6 +67,38 @@ class Moderation(Cog):
         embed.description = '{:.2f}ms'.format(tm)
         return await msg.edit(embed=embed)
 
+    @command(name='stats', help='Статистика команд и запросов', hidden=True, usage='stats [http|discord|loop]')
+    async def stats_(self, ctx, kind=None):
+        if ctx.author.id == discord_pers_id:
+            if kind is None:
+                embed = Embed(color=Color.dark_purple(), title='Команды')
+                for name, histogram in sorted(metrics.commands.items(), key=lambda kv: kv[1].total, reverse=True)[:25]:
+                    embed.add_field(name=f'{name} (выполняется: {metrics.in_flight[name]})', value=str(histogram), inline=False)
+            else:
+                embed = Embed(color=Color.dark_purple(), title=kind)
+                for target, histogram in sorted(metrics.timings.get(kind, {}).items(), key=lambda kv: kv[1].total, reverse=True)[:25]:
+                    retries = metrics.retries.get(kind, {}).get(target, 0)
+                    embed.add_field(name=target, value=f'{histogram}, повторов: {retries}' if retries else str(histogram), inline=False)
+            return await ctx.send(embed=embed)
+
+    @command(name='cachestats', help='Статистика кэшей', hidden=True)
+    async def cachestats_(self, ctx):
+        if ctx.author.id == discord_pers_id:
+            embed = Embed(color=Color.dark_purple(), title='Кэши')
+            for name, cache in caches.items():
+                embed.add_field(name=name, value=str(cache), inline=False)
+            return await ctx.send(embed=embed)
+
+    @command(name='resources', help='Перезагрузка статических ресурсов', hidden=True, usage='resources [reload]')
+    async def resources_(self, ctx, action=None):
+        if ctx.author.id == discord_pers_id:
+            if action == 'reload':
+                resource_cache.reload(force=True)
+            embed = Embed(color=Color.dark_purple(), title='Ресурсы')
+            for name, resource in resource_cache.resources.items():
+                embed.add_field(name=name, value=f'{len(resource)} записей, загружено за {resource.load_time * 1000:.1f}ms', inline=False)
+            return await ctx.send(embed=embed)
+
     @command(name='exec', pass_context=True, help='Не трогай, она тебя сожрет', hidden=True, usage='exec <query>')
     async def exec_(self, ctx, *, query):
         if ctx.author.id == discord_pers_id:
@@ -83,6 +117,7 @@ class Moderation(Cog):
             activity = Streaming(name='Updating...', url='https://twitch.tv/mrdandycorn')
             await self.bot.change_presence(activity=activity)
             system('pm2 pull RaccoonBot')
+            await changelog.refresh()
 
     @command(name='shiki_auth', help='Команда для повторной авторизации на шикимори', hidden=True)
     async def shiki_auth_(self, ctx):
@@ -98,21 +133,8 @@ class Moderation(Cog):
             await req.delete()
             if msg.content.isdigit() and int(msg.content) == 0:
                 return
-            code = msg.content
-            payload = {
-                'client_id': shiki_client_id,
-                'client_secret': shiki_client_secret,
-                'code': code,
-                'grant_type': 'authorization_code',
-                'redirect_uri': 'urn:ietf:wg:oauth:2.0:oob'
-            }
-            headers = {
-                'User-Agent': 'RaccoonBot'
-            }
-            async with ClientSession() as client:
-                req = await client.post('https://shikimori.one/oauth/token', data=payload, headers=headers)
-                req = await req.json()
-            return dump(req, open('resources/shiki.json', 'w+'))
+            await shikimori.authorize(msg.content)
+            return await ctx.send('Токен шикимори обновлен')
 
 
 def mod_setup(bot):
@@ -1,17 +1,19 @@
 from asyncio import sleep
 from json import load, dump
-from os import path, listdir, remove
-from pickle import load as pload, dump as pdump
-from random import sample, choice, shuffle
-from textwrap import wrap
+from random import choice, shuffle
 
-from bs4 import BeautifulSoup
-from credentials import main_password, main_web_addr, gachi_things, genius_token, dev
+from credentials import main_password, main_web_addr, gachi_things, dev
 from discord.ext.commands import Cog, command, Bot
-from lavalink import Client, NodeException, format_time, add_event_hook, TrackEndEvent
-from pathvalidate import validate_filename, ValidationError
+from lavalink import Client, NodeException, format_time, add_event_hook, TrackEndEvent, TrackExceptionEvent, TrackStuckEvent
 
+from genius import genius
 from music_funcs import *
+from playlist_store import PlaylistStore
+from resource_cache import resource_cache
+
+
+auto_disconnect_grace = 0
+gachi = resource_cache.register('gachi', 'resources/gachi.txt')
 
 
 # noinspection PyProtectedMember
@@ -24,9 +26,13 @@ class Music(Cog):
         lc.add_node(addr, 2333, main_password, 'ru', 'default-node')
         bot.add_listener(lc.voice_update_handler, 'on_socket_response')
         self.lavalink = lc
+        self.playlist_store = PlaylistStore()
+        self.occupancy = VoiceOccupancy(bot.user.id, self.stop_playing, auto_disconnect_grace)
 
         self.bot.loop.create_task(self.initialize())
         add_event_hook(update_queues, event=TrackEndEvent)
+        add_event_hook(invalidate_resolution, event=TrackExceptionEvent)
+        add_event_hook(invalidate_resolution, event=TrackStuckEvent)
 
     async def initialize(self):
         saved = load(open('resources/saved.json', 'r'))
@@ -64,16 +70,33 @@ class Music(Cog):
 
     @Cog.listener()
     async def on_voice_state_update(self, member, before, after):
-        if not after.channel and before.channel:
-            if any(self.bot.user in channel.members and all(member.bot for member in channel.members) for channel in member.guild.voice_channels):
-                await self.stop_playing(member.guild.id)
+        self.occupancy.update(member, before, after)
+
+    @Cog.listener()
+    async def on_raw_reaction_add(self, payload):
+        if payload.user_id != self.bot.user.id:
+            queue = queue_views.get(payload.message_id)
+            if queue is not None:
+                return await queue.react(payload)
+
+    @Cog.listener()
+    async def on_raw_reaction_remove(self, payload):
+        if payload.user_id == self.bot.user.id:
+            queue = queue_views.get(payload.message_id)
+            if queue is not None:
+                queue.reactions_cleared(str(payload.emoji))
+
+    @Cog.listener()
+    async def on_raw_reaction_clear(self, payload):
+        queue = queue_views.get(payload.message_id)
+        if queue is not None:
+            queue.reactions_cleared()
 
     @Cog.listener()
-    async def on_reaction_add(self, reaction, user):
-        if user != self.bot.user:
-            for queue in queues:
-                if queue.message.id == reaction.message.id:
-                    return await queue.react(reaction)
+    async def on_raw_reaction_clear_emoji(self, payload):
+        queue = queue_views.get(payload.message_id)
+        if queue is not None:
+            queue.reactions_cleared(str(payload.emoji))
 
     def cog_unload(self):
         self.lavalink._event_hooks.clear()
@@ -116,14 +139,14 @@ class Music(Cog):
             embed.description = f'[{res}]({res.show_url})'
             player.add(requester=ctx.author.id, track=track, index=index)
         elif isinstance(res, Playlist):
-            if not res.tracks:
+            if not res.total:
                 embed.title = '❌Плейлист пустой'
                 return await ctx.send(embed=embed)
-            embed.title = '✅Плейлист добавлен'
-            embed.description = f'{res.title} ({len(res.tracks)} {sform(len(res.tracks), "трек")})'
             procmsg = await ctx.send(embed=Embed(title=f'Плейлист "{res}" загружается...', color=color))
             await res.add(player, ctx.author.id, procmsg, force)
             await procmsg.delete()
+            embed.title = '✅Плейлист добавлен'
+            embed.description = f'{res.title} ({res.total} {sform(res.total, "трек")})'
         elif isinstance(res, list):
             embed_value = ''
             for i, track in enumerate(res[:10]):
@@ -167,9 +190,7 @@ class Music(Cog):
         if amt > 100 or amt < 1:
             return await ctx.send('Нет')
         player = self.lavalink.player_manager.get(ctx.guild.id)
-        with open('resources/gachi.txt', 'r') as f:
-            tracks = load(f)
-        tracks = sample(tracks, amt)
+        tracks = gachi.sample(amt)
         player.add(requester=ctx.author.id, track=tracks.pop(0))
         await ctx.send(choice(gachi_things))
         if not player.is_playing:
@@ -231,40 +252,24 @@ class Music(Cog):
             return await ctx.send('Ничего не играет')
         title = player.current.title
         ftitle = re.sub(r'(?:\[([^]]+?)]|\(([^)]+?)\)|lyric video|lyrics video|lyrics)', '', title, flags=re.IGNORECASE).strip()
-        params = {
-            'q': ftitle
-        }
-        headers = {
-            'Authorization': 'Bearer ' + genius_token
-        }
-        async with ClientSession() as client:
-            req = await client.get('https://api.genius.com/search', params=params, headers=headers)
-            res = await req.json()
-        results = res['response']['hits']
+        results = await genius.search(ftitle)
         if len(results) == 0:
             return await ctx.send('Песня не найдена')
         result = results[0]
-        if result['type'] != 'song' or result['result']['lyrics_state'] != 'complete':
+        if not genius.complete(result):
             return await ctx.send('Текст песни не найден')
-        url = result['result']['url']
-        title = f'{result["result"]["primary_artist"]["name"]} - {result["result"]["title"]}'
-        async with ClientSession() as client:
-            lyrics = await client.get(url)
-            lyrics = await lyrics.text()
-        soup = BeautifulSoup(lyrics, 'html.parser')
-        lyrics = soup.p.get_text()
-        if len(lyrics) > 4000:
+        title = genius.title(result['result'])
+        lyrics = await genius.lyrics(result['result'])
+        if not lyrics['pages']:
+            return await ctx.send('Текст песни не найден')
+        if lyrics['length'] > 4000:
             return await ctx.send('Слишком длинный текст, скорее всего это не текст песни')
-        if len(lyrics) > 2000:
-            messages = wrap(lyrics, 2000)
-            embed = Embed(color=Color.dark_purple())
-            for segment, message in enumerate(messages):
-                embed.title = f'Текст {title} ({segment + 1})'
-                embed.description = message
-                await ctx.send(embed=embed)
-        else:
-            embed = Embed(color=Color.dark_purple(), title=f'Текст {title}', description=lyrics)
-            return await ctx.send(embed=embed)
+        pages = lyrics['pages']
+        embed = Embed(color=Color.dark_purple())
+        for segment, page in enumerate(pages):
+            embed.title = f'Текст {title} ({segment + 1})' if len(pages) > 1 else f'Текст {title}'
+            embed.description = page
+            await ctx.send(embed=embed)
 
     @command(aliases=['q', 'list'], help='Команда для отображения очереди воспроизведения')
     async def queue(self, ctx):
@@ -272,7 +277,6 @@ class Music(Cog):
         if not player.queue:
             return await ctx.send('Очередь пустая')
         queue = Queue(player, ctx)
-        queues.append(queue)
         return await queue.send()
 
     @command(usage='save <название>', help='Команда для сохранения текущей очереди в плейлист')
@@ -280,65 +284,38 @@ class Music(Cog):
         player = self.lavalink.player_manager.get(ctx.guild.id)
         if not player.queue and not player.current:
             return await ctx.send('Очередь пустая')
-        playlists = listdir(path.join('resources', 'playlists'))
-        playlist_name = f'{ctx.author.id}_{name.lower()}'
-        try:
-            validate_filename(playlist_name)
-        except ValidationError:
-            return await ctx.send('Запрещенные символы в названии плейлиста')
-        if playlist_name in playlists:
-            return await ctx.send(f'Плейлист с таким названием уже существует\nДля удаления плейлиста используйте {ctx.prefix}delete <название>')
         if len(name) > 100:
             return await ctx.send('Слишком длинное название для плейлиста')
+        if await self.playlist_store.exists(ctx.author.id, name.lower()):
+            return await ctx.send(f'Плейлист с таким названием уже существует\nДля удаления плейлиста используйте {ctx.prefix}delete <название>')
         local_queue = player.queue.copy() if player.queue else []
         if player.current:
             local_queue.insert(0, player.current)
-        with open(path.join('resources', 'playlists', playlist_name), 'wb+') as queue_file:
-            pdump(local_queue, queue_file)
-        ln = len(local_queue)
+        ln = await self.playlist_store.save(ctx.author.id, name.lower(), local_queue)
         return await ctx.send(f'Плейлист {name} [{ln} {sform(ln, "трек")}] сохранен')
 
     @command(usage='load <название>', help='Команда для загрузки плейлиста в очередь')
     async def load(self, ctx, *, name):
         player = self.lavalink.player_manager.get(ctx.guild.id)
-        playlists = listdir(path.join('resources', 'playlists'))
-        playlist_name = f'{ctx.author.id}_{name.lower()}'
-        try:
-            validate_filename(playlist_name)
-        except ValidationError:
-            return await ctx.send('Запрещенные символы в названии плейлиста')
-        if playlist_name not in playlists:
+        playlist = await self.playlist_store.load(ctx.author.id, name.lower())
+        if playlist is None:
             return await ctx.send(f'Нет плейлиста с таким названием\nДля просмотра своих плейлистов используйте {ctx.prefix}playlists')
-        with open(path.join('resources', 'playlists', playlist_name), 'rb') as queue_file:
-            queue = pload(queue_file)
-        for track in queue:
+        tracks, ln = playlist
+        for track in tracks:
             player.add(requester=ctx.author.id, track=track)
-        ln = len(queue)
         await ctx.send(f'Плейлист {name} [{ln} {sform(ln, "трек")}] добавлен в очередь')
         if not player.is_playing:
             await player.play()
 
     @command(usage='delete <название>', help='Команда для удаления сохраненного плейлиста')
     async def delete(self, ctx, *, name):
-        playlists = listdir(path.join('resources', 'playlists'))
-        playlist_name = f'{ctx.author.id}_{name.lower()}'
-        try:
-            validate_filename(playlist_name)
-        except ValidationError:
-            return await ctx.send('Запрещенные символы в названии плейлиста')
-        if playlist_name not in playlists:
+        if not await self.playlist_store.delete(ctx.author.id, name.lower()):
             return await ctx.send(f'Нет плейлиста с таким названием\nДля просмотра своих плейлистов используйте {ctx.prefix}playlists')
-        remove(path.join('resources', 'playlists', playlist_name))
         return await ctx.send(f'Плейлист {name} удален!')
 
     @command(help='Команда для просмотра списка сохраненных плейлистов')
     async def playlists(self, ctx):
-        playlists = listdir(path.join('resources', 'playlists'))
-        personal = []
-        for playlist in playlists:
-            user_id, name = playlist.split('_', 1)
-            if int(user_id) == ctx.author.id:
-                personal.append(name)
+        personal = await self.playlist_store.names(ctx.author.id)
         if not personal:
             return await ctx.send('У вас нет сохраненных плейлистов!')
         embed = Embed(color=Color.dark_purple(), title='Сохраненные плейлисты',
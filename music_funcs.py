@@ -1,15 +1,16 @@
-from asyncio import get_event_loop
+from asyncio import get_event_loop, gather, sleep, Lock, Semaphore, Queue as TaskQueue, Task
 from base64 import b64encode
 from math import ceil
 from time import time
 
 import regex as re
-from aiohttp import ClientSession
 from credentials import vk_personal_audio_token, spotify_client_id, spotify_client_secret
-from discord import Embed, Color
+from discord import Embed, Color, Object
 from discord.ext.commands import CommandInvokeError
 from lavalink import DefaultPlayer
 
+from cache import TTLCache, DiskCache
+from http_client import http
 from utils import sform
 
 agent = 'KateMobileAndroid/52.1 lite-445 (Android 4.4.2; SDK 19; x86; unknown Android SDK built for x86; en)'
@@ -18,14 +19,22 @@ vk_album_rx = re.compile(r'(?:audio_playlist|album\/|playlist\/)(-?[0-9]+)_([0-9
 vk_pers_rx = re.compile(r'audios(-?[0-9]+)')
 spotify_rx = re.compile(r'(?:spotify:|(?:https?:\/\/)?(?:www\.)?open\.spotify\.com\/)(playlist|track|album)(?:\:|\/)([a-zA-Z0-9]+)(.*)$')
 url_rx = re.compile(r'https?://(?:www\.)?.+')
+space_rx = re.compile(r'\s+')
+
+track_cache = TTLCache('lavalink', maxsize=4096, ttl=3600, negative_ttl=300)
+resolutions = DiskCache('resolutions', ttl=30 * 86400)
+resolved_keys = TTLCache(None, maxsize=20000, ttl=86400)
+vk_resolution_ttl = 6 * 3600
 
 
 class Track:
-    def __init__(self, author, title, url=None, show_url=None):
+    def __init__(self, author, title, url=None, show_url=None, source='search', ident=None):
         self.author = author
         self.title = title
         self.url = url
         self._show_url = show_url
+        self.source = source
+        self.ident = ident
 
     def __str__(self):
         return f'{self.author} - {self.title}'
@@ -38,49 +47,134 @@ class Track:
     def uri(self):
         return self.url or str(self)
 
+    @property
+    def key(self):
+        return f'{self.source}:{self.ident or str(self).lower()}'
+
     async def get_track(self, player):
-        track = await get_track(player, self.uri, True)
-        if not isinstance(track, dict):
-            return
-        track['info']['author'] = self.author
-        track['info']['title'] = str(self)
-        track['info']['uri'] = self.show_url
+        track = await resolutions.get(self.key)
+        if track is None:
+            track = await get_track(player, self.uri, True)
+            if not isinstance(track, dict):
+                return
+            track = dict(track, info=dict(track['info']))
+            track['info']['author'] = self.author
+            track['info']['title'] = str(self)
+            track['info']['uri'] = self.show_url
+            await resolutions.set(self.key, track, vk_resolution_ttl if self.url else None)
+        resolved_keys.set(track['track'], (self.key, self.uri))
         return track
 
 
+async def invalidate_resolution(event):
+    resolved = resolved_keys.get(event.track.track)
+    if resolved is None:
+        return
+    key, uri = resolved
+    resolved_keys.pop(event.track.track)
+    track_cache.pop(uri if url_rx.match(uri) else normalize_query(f'ytsearch:{uri}'))
+    await resolutions.delete(key)
+
+
+resolve_concurrency = 8
+node_semaphores = {}
+
+
+def get_node_semaphore(node):
+    semaphore = node_semaphores.get(node)
+    if semaphore is None:
+        semaphore = node_semaphores[node] = Semaphore(resolve_concurrency)
+    return semaphore
+
+
 class Playlist:
-    def __init__(self, title, tracks):
+    def __init__(self, title, tracks, total=None, pending=None):
         self.title = title
         self.tracks = tracks
+        self.total = len(tracks) if total is None else total
+        self.pending = pending
         self.message_update_frequency = 5
 
     def __str__(self):
         return self.title
 
     @staticmethod
-    def get_embed(msg, progress, total):
+    def get_embed(msg, progress, total, failed=0):
         old = msg.embeds[0]
         old.description = f'Загрузка: {progress}/{total}'
+        if failed:
+            old.description += f'\nНе найдено: {failed}'
         return old
 
+    @staticmethod
+    async def resolve(track, player):
+        async with get_node_semaphore(player.node):
+            try:
+                return await track.get_track(player)
+            except Exception as e:
+                print(f'Failed to resolve {track}: {e}')
+
+    async def collect(self):
+        if self.pending is not None:
+            async for page in self.pending:
+                self.tracks.extend(page)
+            self.pending = None
+        self.total = len(self.tracks)
+
+    def prepare(self, track, player):
+        if isinstance(track, dict):
+            return track
+        return player.loop.create_task(self.resolve(track, player))
+
+    async def schedule(self, player, queue, force):
+        tracks = list(reversed(self.tracks)) if force else self.tracks
+        try:
+            for track in tracks:
+                queue.put_nowait(self.prepare(track, player))
+            if self.pending is not None:
+                async for page in self.pending:
+                    self.tracks.extend(page)
+                    for track in page:
+                        queue.put_nowait(self.prepare(track, player))
+                self.pending = None
+                self.total = len(self.tracks)
+        except Exception as e:
+            print(f'Failed to load playlist {self}: {e}')
+        finally:
+            queue.put_nowait(None)
+
     async def add(self, player, requester, msg, force=False):
-        if not self.tracks:
+        if force:
+            await self.collect()
+        if not self.tracks and self.pending is None:
             return
-        simple = isinstance(self.tracks[0], dict)
-        tracks = reversed(self.tracks) if force else self.tracks
         index = 0 if force else None
-        await msg.edit(embed=self.get_embed(msg, 0, len(tracks)))
-        for i, track in enumerate(tracks):
-            if simple:
-                player.add(requester=requester, track=track, index=index)
-            else:
-                audiotrack = await track.get_track(player)
+        await msg.edit(embed=self.get_embed(msg, 0, self.total))
+        queue = TaskQueue()
+        producer = player.loop.create_task(self.schedule(player, queue, force))
+        completed = failed = processed = 0
+        try:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    break
+                audiotrack = await item if isinstance(item, Task) else item
                 if audiotrack:
                     player.add(requester=requester, track=audiotrack, index=index)
-            if not player.is_playing:
-                await player.play()
-            if (i + 1) % self.message_update_frequency == 0:
-                await msg.edit(embed=self.get_embed(msg, i+1, len(tracks)))
+                    completed += 1
+                else:
+                    failed += 1
+                if not player.is_playing and player.queue:
+                    await player.play()
+                processed += 1
+                if processed % self.message_update_frequency == 0:
+                    await msg.edit(embed=self.get_embed(msg, completed, self.total, failed))
+        finally:
+            producer.cancel()
+            while not queue.empty():
+                item = queue.get_nowait()
+                if isinstance(item, Task):
+                    item.cancel()
 
 
 async def get_vk_album(url):
@@ -98,11 +192,8 @@ async def get_vk_album(url):
     }
     if album.group(3):
         params['access_key'] = album.group(3)
-    async with ClientSession() as client:
-        res = await client.get('https://api.vk.com/method/audio.get', headers=headers, params=params)
-        playlist = await client.get('https://api.vk.com/method/audio.getPlaylistById', headers=headers, params=params)
-        res = await res.json()
-        playlist = await playlist.json()
+    res, playlist = await gather(http.get_json('https://api.vk.com/method/audio.get', headers=headers, params=params),
+                                 http.get_json('https://api.vk.com/method/audio.getPlaylistById', headers=headers, params=params))
     if 'error' in res.keys():
         if res['error']['error_code'] == 201:
             return Embed(color=Color.blue(), title='❌Нет доступа к аудио пользователя')
@@ -117,7 +208,8 @@ async def get_vk_album(url):
     if album.group(3):
         album_url += f'_{album.group(3)}'
     return Playlist(playlist['title'],
-                    [Track(item['artist'], item['title'], item['url'], album_url) for item in res['items'] if item['url']])
+                    [Track(item['artist'], item['title'], item['url'], album_url, 'vk', f'{item["owner_id"]}_{item["id"]}')
+                     for item in res['items'] if item['url']])
 
 
 async def get_vk_personal(url):
@@ -133,9 +225,7 @@ async def get_vk_personal(url):
         'owner_id': user.group(1),
         'need_user': 1
     }
-    async with ClientSession() as client:
-        ans = await client.get('https://api.vk.com/method/audio.get', headers=headers, params=params)
-        res = await ans.json()
+    res = await http.get_json('https://api.vk.com/method/audio.get', headers=headers, params=params)
     if 'error' in res.keys():
         if res['error']['error_code'] == 201:
             return Embed(color=Color.blue(), title='❌Нет доступа к аудио пользователя')
@@ -146,7 +236,8 @@ async def get_vk_personal(url):
     user_info = items.pop(0)
     audios_url = f'https://vk.com/audios/{user.group(1)}'
     return Playlist(f'Аудиозаписи {user_info["name_gen"]}',
-                    [Track(item['artist'], item['title'], item['url'], audios_url) for item in items if item['url']])
+                    [Track(item['artist'], item['title'], item['url'], audios_url, 'vk', f'{item["owner_id"]}_{item["id"]}')
+                     for item in items if item['url']])
 
 
 class Spotify:
@@ -159,7 +250,6 @@ class Spotify:
     def __init__(self, client_id, client_secret):
         self.client_id = client_id
         self.client_secret = client_secret
-        self.aiosession = ClientSession()
         self.loop = get_event_loop()
 
         self.token = None
@@ -178,22 +268,39 @@ class Spotify:
         return await self.make_spotify_req(self.API_BASE + f'albums/{uri}')
 
     async def get_playlist(self, uri):
-        return await self.make_spotify_req(self.API_BASE + f'playlists/{uri}')
+        return await self.make_spotify_req(self.API_BASE + f'playlists/{uri}?fields=name')
 
     async def get_playlist_tracks(self, uri):
-        return await self.make_spotify_req(self.API_BASE + f'playlists/{uri}/tracks')
+        return await self.make_spotify_req(self.API_BASE + f'playlists/{uri}/tracks?limit=100')
+
+    async def iter_pages(self, url, first, limit, fanout=4):
+        yield first['items']
+        semaphore = Semaphore(fanout)
+
+        async def fetch(offset):
+            async with semaphore:
+                return await self.make_spotify_req(f'{url}?offset={offset}&limit={limit}')
+
+        offsets = range(first['offset'] + len(first['items']), first['total'], limit)
+        tasks = [self.loop.create_task(fetch(offset)) for offset in offsets]
+        try:
+            for task in tasks:
+                yield (await task)['items']
+        finally:
+            for task in tasks:
+                task.cancel()
 
     async def make_spotify_req(self, url):
         token = await self.get_token()
         return await self.make_get(url, headers={'Authorization': f'Bearer {token}'})
 
-    async def make_get(self, url, headers=None):
-        async with self.aiosession.get(url, headers=headers) as r:
-            return await r.json()
+    @staticmethod
+    async def make_get(url, headers=None):
+        return await http.get_json(url, headers=headers)
 
-    async def make_post(self, url, payload, headers=None):
-        async with self.aiosession.post(url, data=payload, headers=headers) as r:
-            return await r.json()
+    @staticmethod
+    async def make_post(url, payload, headers=None):
+        return await http.post_json(url, data=payload, headers=headers)
 
     async def get_token(self):
         if self.token and not await self.check_token(self.token):
@@ -221,26 +328,59 @@ spotify = Spotify(spotify_client_id, spotify_client_secret)
 
 async def get_spotify_track(uri):
     res = await spotify.get_track(uri)
-    return Track(res["artists"][0]["name"], res["name"], show_url=res['external_urls']['spotify'])
+    return Track(res["artists"][0]["name"], res["name"], show_url=res['external_urls']['spotify'], source='spotify', ident=res['id'])
+
+
+def spotify_tracks(items):
+    return [Track(item['artists'][0]['name'], item['name'], show_url=item['external_urls']['spotify'], source='spotify', ident=item['id'])
+            for item in items]
+
+
+async def spotify_pages(pages):
+    async for items in pages:
+        yield spotify_tracks(items)
 
 
 async def get_spotify_album(uri):
     res = await spotify.get_album(uri)
-    tracks = [Track(item['artists'][0]['name'], item['name'], show_url=item['external_urls']['spotify']) for item in res['tracks']['items']]
-    return Playlist(res['name'], tracks)
+    first = res['tracks']
+    pages = spotify.iter_pages(spotify.API_BASE + f'albums/{uri}/tracks', first, 50)
+    return Playlist(res['name'], spotify_tracks(first['items']), first['total'], spotify_pages(pages))
+
+
+def playlist_tracks(items):
+    return [Track(item['track']['artists'][0]['name'], item['track']['name'], show_url=item['track']['external_urls']['spotify'],
+                  source='spotify', ident=item['track']['id'])
+            for item in items if item['track'] and not item['is_local']]
+
+
+async def playlist_pages(playlist, pages):
+    async for items in pages:
+        tracks = playlist_tracks(items)
+        playlist.total -= len(items) - len(tracks)
+        yield tracks
 
 
 async def get_spotify_playlist(uri):
-    res = []
-    r = await spotify.get_playlist_tracks(uri)
-    while True:
-        res.extend(r['items'])
-        if r['next'] is None:
-            break
-        r = await spotify.make_spotify_req(r['next'])
-    tracks = [Track(item['track']['artists'][0]['name'], item['track']['name'], show_url=item['track']['external_urls']['spotify']) for item in res if not item['is_local']]
-    playlist = await spotify.get_playlist(uri)
-    return Playlist(playlist['name'], tracks)
+    first, info = await gather(spotify.get_playlist_tracks(uri), spotify.get_playlist(uri))
+    playlist = Playlist(info['name'], [], first['total'])
+    playlist.pending = playlist_pages(playlist, spotify.iter_pages(spotify.API_BASE + f'playlists/{uri}/tracks', first, 100))
+    playlist.tracks = await playlist.pending.__anext__()
+    return playlist
+
+
+def normalize_query(query):
+    if query.startswith('ytsearch:'):
+        return 'ytsearch:' + space_rx.sub(' ', query[9:]).strip().lower()
+    return query
+
+
+def no_tracks(results):
+    return not results or not results['tracks']
+
+
+async def load_tracks(node, query):
+    return await track_cache.get_or_load(normalize_query(query), lambda: node.get_tracks(query), no_tracks)
 
 
 async def get_track(player, query, force_first=False):
@@ -263,7 +403,7 @@ async def get_track(player, query, force_first=False):
             return await get_vk_personal(query)
     else:
         query = f'ytsearch:{query}'
-    results = await player.node.get_tracks(query)
+    results = await load_tracks(player.node, query)
     if not results or not results['tracks']:
         return 'Ничего не найдено'
     if results['loadType'] == 'PLAYLIST_LOADED':
@@ -300,7 +440,100 @@ class MusicCommandError(CommandInvokeError):
     pass
 
 
-queues = []
+class QueueViews:
+    def __init__(self, interval=2):
+        self.interval = interval
+        self.by_guild = {}
+        self.by_message = {}
+        self._dirty = set()
+        self._scheduled = False
+
+    def register(self, queue):
+        self.by_message[queue.message.id] = queue
+        self.by_guild.setdefault(queue.player.guild_id, {})[queue.message.id] = queue
+
+    def unregister(self, queue):
+        self.by_message.pop(queue.message.id, None)
+        views = self.by_guild.get(queue.player.guild_id)
+        if views is not None:
+            views.pop(queue.message.id, None)
+            if not views:
+                del self.by_guild[queue.player.guild_id]
+
+    def get(self, message_id):
+        return self.by_message.get(message_id)
+
+    def mark_dirty(self, player):
+        if player.guild_id not in self.by_guild:
+            return
+        self._dirty.add(player.guild_id)
+        if not self._scheduled:
+            self._scheduled = True
+            get_event_loop().create_task(self.flush_later())
+
+    async def flush_later(self):
+        await sleep(self.interval)
+        self._scheduled = False
+        dirty, self._dirty = self._dirty, set()
+        for guild_id in dirty:
+            for queue in list(self.by_guild.get(guild_id, {}).values()):
+                try:
+                    await queue.update()
+                except Exception as e:
+                    print(f'Failed to update queue view: {e}')
+
+
+queue_views = QueueViews()
+
+
+class VoiceOccupancy:
+    def __init__(self, bot_id, on_empty, grace=0):
+        self.bot_id = bot_id
+        self.on_empty = on_empty
+        self.grace = grace
+        self.channels = {}
+        self.listeners = {}
+        self.timers = {}
+
+    def update(self, member, before, after):
+        guild_id = member.guild.id
+        if member.id == self.bot_id:
+            if after.channel is None:
+                self.channels.pop(guild_id, None)
+                self.listeners.pop(guild_id, None)
+                self.cancel(guild_id)
+                return
+            if before.channel is not None and before.channel.id == after.channel.id:
+                return
+            self.channels[guild_id] = after.channel.id
+            self.listeners[guild_id] = sum(not m.bot for m in after.channel.members)
+        else:
+            channel_id = self.channels.get(guild_id)
+            if member.bot or channel_id is None:
+                return
+            was_here = before.channel is not None and before.channel.id == channel_id
+            is_here = after.channel is not None and after.channel.id == channel_id
+            if was_here == is_here:
+                return
+            self.listeners[guild_id] += 1 if is_here else -1
+        self.check(guild_id)
+
+    def cancel(self, guild_id):
+        timer = self.timers.pop(guild_id, None)
+        if timer is not None:
+            timer.cancel()
+
+    def check(self, guild_id):
+        if self.listeners.get(guild_id):
+            self.cancel(guild_id)
+        elif guild_id not in self.timers:
+            self.timers[guild_id] = get_event_loop().create_task(self.expire(guild_id))
+
+    async def expire(self, guild_id):
+        await sleep(self.grace)
+        del self.timers[guild_id]
+        if guild_id in self.channels and not self.listeners.get(guild_id):
+            await self.on_empty(guild_id)
 
 
 class Queue:
@@ -309,11 +542,15 @@ class Queue:
         self.context = context
         self.message = None
         self.page = 0
+        self.reactions = []
         self._items_per_page = items_per_page
+        self._lock = Lock()
 
     async def send(self):
         self.message = await self.context.send(embed=self.embed)
-        await self.update_emojis()
+        queue_views.register(self)
+        async with self._lock:
+            await self.update_emojis()
 
     @property
     def pages(self):
@@ -350,58 +587,59 @@ class Queue:
             result.extend(['▶', '⏭'])
         return result
 
-    async def react(self, reaction):
-        emoji = str(reaction)
-        if emoji not in self.emojis_list:
-            return await reaction.clear()
-        elif emoji == '❌':
-            return await self.delete()
-        elif emoji == '⏮':
-            self.page = 0
-        elif emoji == '◀':
-            self.page -= 1
-        elif emoji == '▶':
-            self.page += 1
-        elif emoji == '⏭':
-            self.page = self.pages - 1
-        return await self.update()
-
-    async def update_message(self):
-        self.message = await self.context.fetch_message(self.message.id)
-
-    @property
-    def message_emojis(self):
-        return [str(reaction) for reaction in self.message.reactions]
-
-    async def clear_reactions_but_from_bot(self):
-        await self.update_message()
-        for reaction in self.message.reactions:
-            if reaction.count > 1:
-                async for user in reaction.users():
-                    if user != self.context.bot.user:
-                        await reaction.remove(user)
+    async def react(self, payload):
+        emoji = str(payload.emoji)
+        try:
+            if emoji not in self.emojis_list:
+                return
+            elif emoji == '❌':
+                return await self.delete()
+            elif emoji == '⏮':
+                self.page = 0
+            elif emoji == '◀':
+                self.page -= 1
+            elif emoji == '▶':
+                self.page += 1
+            elif emoji == '⏭':
+                self.page = self.pages - 1
+            return await self.update()
+        finally:
+            if self.message.id in queue_views.by_message:
+                await self.message.remove_reaction(payload.emoji, payload.member or Object(id=payload.user_id))
+
+    def reactions_cleared(self, emoji=None):
+        if emoji is None and self.reactions:
+            self.reactions.clear()
+        elif emoji in self.reactions:
+            self.reactions.remove(emoji)
+        else:
+            return
+        queue_views.mark_dirty(self.player)
 
     async def update_emojis(self):
-        await self.update_message()
-        for emoji in self.message_emojis:
-            if emoji not in self.emojis_list:
-                await self.message.clear_reaction(emoji)
-        for emoji in self.emojis_list:
-            if emoji not in self.message_emojis:
+        wanted = self.emojis_list
+        for emoji in [emoji for emoji in self.reactions if emoji not in wanted]:
+            if emoji not in self.reactions:
+                continue
+            self.reactions.remove(emoji)
+            await self.message.remove_reaction(emoji, self.context.bot.user)
+        for emoji in wanted:
+            if emoji not in self.reactions:
+                self.reactions.append(emoji)
                 await self.message.add_reaction(emoji)
-        await self.clear_reactions_but_from_bot()
 
     async def delete(self):
-        queues.remove(self)
+        queue_views.unregister(self)
         return await self.message.delete()
 
     async def update(self):
-        if self.pages == 0:
-            return await self.delete()
-        if self.page >= self.pages:
-            self.page = self.pages - 1
-        await self.message.edit(embed=self.embed)
-        await self.update_emojis()
+        async with self._lock:
+            if self.pages == 0:
+                return await self.delete()
+            if self.page >= self.pages:
+                self.page = self.pages - 1
+            await self.message.edit(embed=self.embed)
+            await self.update_emojis()
 
 
 async def update_queues(event):
@@ -409,9 +647,7 @@ async def update_queues(event):
         player = event
     else:
         player = event.player
-    for queue in queues:
-        if queue.player == player:
-            await queue.update()
+    queue_views.mark_dirty(player)
 
 
 class Player(DefaultPlayer):
@@ -421,8 +657,8 @@ class Player(DefaultPlayer):
 
     async def play(self, *args, **kwargs):
         await super().play(*args, **kwargs)
-        await update_queues(self)
+        queue_views.mark_dirty(self)
 
     def add(self, *args, **kwargs):
         super().add(*args, **kwargs)
-        self.loop.create_task(update_queues(self))
+        queue_views.mark_dirty(self)
@@ -0,0 +1,121 @@
+import sqlite3
+from asyncio import get_event_loop
+from json import dumps, loads
+from os import path, listdir, rename
+from pickle import load as pload
+from threading import Lock
+
+from lavalink import decode_track
+
+override_fields = ('title', 'author', 'uri')
+
+
+def track_data(encoded):
+    track = decode_track(encoded)
+    return {
+        'track': encoded,
+        'info': {
+            'title': track.title,
+            'author': track.author,
+            'length': track.duration,
+            'identifier': track.identifier,
+            'isStream': track.stream,
+            'uri': track.uri,
+            'isSeekable': track.is_seekable
+        }
+    }
+
+
+def encode_entry(track):
+    decoded = decode_track(track.track)
+    overrides = {field: getattr(track, field) for field in override_fields if getattr(decoded, field) != getattr(track, field)}
+    return [track.track, overrides] if overrides else track.track
+
+
+def decode_entry(entry):
+    if isinstance(entry, str):
+        return track_data(entry)
+    encoded, overrides = entry
+    track = track_data(encoded)
+    track['info'].update(overrides)
+    return track
+
+
+class PlaylistStore:
+    """
+    Сохраненные плейлисты в SQLite: закодированные треки Lavalink по (user_id, name)
+    """
+
+    def __init__(self, db_path='resources/playlists.db', legacy_dir='resources/playlists'):
+        self._lock = Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS playlists (user_id INTEGER NOT NULL, name TEXT NOT NULL, size INTEGER NOT NULL, '
+                         'tracks TEXT NOT NULL, PRIMARY KEY (user_id, name))')
+        self._db.commit()
+        if path.isdir(legacy_dir):
+            self._migrate(legacy_dir)
+
+    def _migrate(self, legacy_dir):
+        migrated, failed = 0, 0
+        for filename in listdir(legacy_dir):
+            try:
+                user_id, name = filename.split('_', 1)
+                with open(path.join(legacy_dir, filename), 'rb') as queue_file:
+                    queue = pload(queue_file)
+                self._save(int(user_id), name, [encode_entry(track) for track in queue], replace=False)
+                migrated += 1
+            except Exception as e:
+                failed += 1
+                print(f'Failed to migrate playlist {filename}: {e}')
+        print(f'Migrated {migrated} playlists from {legacy_dir}')
+        if failed:
+            print(f'{failed} playlists failed to migrate, {legacy_dir} is kept for the next start')
+        else:
+            rename(legacy_dir, legacy_dir + '.migrated')
+
+    def _save(self, user_id, name, entries, replace=True):
+        verb = 'INSERT OR REPLACE' if replace else 'INSERT OR IGNORE'
+        with self._lock, self._db:
+            self._db.execute(f'{verb} INTO playlists (user_id, name, size, tracks) VALUES (?, ?, ?, ?)',
+                             (user_id, name, len(entries), dumps(entries, separators=(',', ':'))))
+
+    def _load(self, user_id, name):
+        with self._lock:
+            row = self._db.execute('SELECT tracks FROM playlists WHERE user_id = ? AND name = ?', (user_id, name)).fetchone()
+        return loads(row[0]) if row else None
+
+    def _delete(self, user_id, name):
+        with self._lock, self._db:
+            return self._db.execute('DELETE FROM playlists WHERE user_id = ? AND name = ?', (user_id, name)).rowcount > 0
+
+    def _names(self, user_id):
+        with self._lock:
+            return [row[0] for row in self._db.execute('SELECT name FROM playlists WHERE user_id = ? ORDER BY rowid', (user_id,))]
+
+    def _exists(self, user_id, name):
+        with self._lock:
+            return self._db.execute('SELECT 1 FROM playlists WHERE user_id = ? AND name = ?', (user_id, name)).fetchone() is not None
+
+    async def run(self, func, *args):
+        return await get_event_loop().run_in_executor(None, func, *args)
+
+    async def exists(self, user_id, name):
+        return await self.run(self._exists, user_id, name)
+
+    async def save(self, user_id, name, tracks):
+        entries = [encode_entry(track) for track in tracks]
+        await self.run(self._save, user_id, name, entries)
+        return len(entries)
+
+    async def load(self, user_id, name):
+        entries = await self.run(self._load, user_id, name)
+        if entries is None:
+            return None
+        return (decode_entry(entry) for entry in entries), len(entries)
+
+    async def delete(self, user_id, name):
+        return await self.run(self._delete, user_id, name)
+
+    async def names(self, user_id):
+        return await self.run(self._names, user_id)
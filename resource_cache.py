@@ -0,0 +1,77 @@
+from asyncio import sleep, get_event_loop
+from json import load
+from os import stat
+from random import choice, sample
+from time import monotonic
+
+
+class Resource:
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+        self.items = ()
+        self.mtime = None
+        self.load_time = 0.0
+
+    def __len__(self):
+        return len(self.items)
+
+    def load(self, force=False):
+        mtime = stat(self.path).st_mtime
+        if mtime == self.mtime and not force:
+            return False
+        started = monotonic()
+        with open(self.path, 'r') as f:
+            items = tuple(load(f))
+        self.items, self.mtime, self.load_time = items, mtime, monotonic() - started
+        return True
+
+    def choice(self):
+        return choice(self.items)
+
+    def sample(self, amount):
+        return sample(self.items, amount)
+
+
+class ResourceCache:
+    """
+    Статические списки из resources/ в памяти с перезагрузкой при изменении файлов
+    """
+
+    def __init__(self, check_interval=60):
+        self.check_interval = check_interval
+        self.resources = {}
+        self._watching = False
+
+    def __getitem__(self, name):
+        return self.resources[name]
+
+    def register(self, name, path):
+        resource = self.resources.get(name)
+        if resource is None:
+            resource = self.resources[name] = Resource(name, path)
+            resource.load()
+        return resource
+
+    def reload(self, force=False):
+        reloaded = []
+        for resource in self.resources.values():
+            try:
+                if resource.load(force):
+                    reloaded.append(resource.name)
+            except Exception as e:
+                print(f'Failed to reload {resource.path}: {e}')
+        return reloaded
+
+    async def watch(self):
+        if self._watching:
+            return
+        self._watching = True
+        while True:
+            await sleep(self.check_interval)
+            reloaded = await get_event_loop().run_in_executor(None, self.reload)
+            if reloaded:
+                print(f'Reloaded resources: {", ".join(reloaded)}')
+
+
+resource_cache = ResourceCache()
@@ -0,0 +1,144 @@
+from asyncio import sleep, Lock, get_event_loop
+from json import load, dump
+from os import replace
+from time import time, monotonic
+
+from credentials import shiki_client_id, shiki_client_secret
+
+from cache import TTLCache
+from http_client import http
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = monotonic()
+        self._lock = Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await sleep((1 - self.tokens) / self.rate)
+
+
+class ShikimoriError(Exception):
+    pass
+
+
+class Shikimori:
+    """
+    Клиент API шикимори: токен читается из файла при первом запросе, кэш ответов и ограничение частоты запросов (5 rps, 90 rpm)
+    """
+    BASE = 'https://shikimori.one'
+    USER_AGENT = 'RaccoonBot'
+
+    def __init__(self, token_path='resources/shiki.json', refresh_margin=600):
+        self.token_path = token_path
+        self.refresh_margin = refresh_margin
+        self.token = None
+        self._loaded = False
+        self.searches = TTLCache('shiki_search', maxsize=512, ttl=1800)
+        self.details = TTLCache('shiki_anime', maxsize=1024, ttl=3600)
+        self.buckets = (TokenBucket(5, 5), TokenBucket(90 / 60, 90))
+        self._refresh_lock = Lock()
+
+    @property
+    def expires_at(self):
+        return self.token['created_at'] + self.token['expires_in']
+
+    def expiring(self):
+        return time() + self.refresh_margin >= self.expires_at
+
+    def _read(self):
+        try:
+            with open(self.token_path, 'r') as f:
+                token = load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError as e:
+            print(f'Failed to read shikimori token from {self.token_path}: {e}')
+            return None
+        if not isinstance(token, dict) or not all(key in token for key in ('access_token', 'refresh_token', 'created_at', 'expires_in')):
+            print(f'Invalid shikimori token in {self.token_path}')
+            return None
+        return token
+
+    async def load_token(self):
+        if not self._loaded:
+            token = await get_event_loop().run_in_executor(None, self._read)
+            if not self._loaded:
+                self.token, self._loaded = token, True
+        return self.token
+
+    def _save(self, token):
+        tmp = self.token_path + '.tmp'
+        with open(tmp, 'w') as f:
+            dump(token, f)
+        replace(tmp, self.token_path)
+
+    async def set_token(self, token):
+        self.token = token
+        self._loaded = True
+        await get_event_loop().run_in_executor(None, self._save, token)
+
+    async def request_token(self, payload):
+        payload = dict(payload, client_id=shiki_client_id, client_secret=shiki_client_secret)
+        token = await http.post_json(self.BASE + '/oauth/token', data=payload, headers={'User-Agent': self.USER_AGENT})
+        if 'access_token' not in token:
+            raise ValueError(f'Не удалось получить токен шикимори: {token}')
+        await self.set_token(token)
+        return token
+
+    async def authorize(self, code):
+        return await self.request_token({'grant_type': 'authorization_code', 'code': code, 'redirect_uri': 'urn:ietf:wg:oauth:2.0:oob'})
+
+    async def get_token(self):
+        if await self.load_token() is None:
+            raise ShikimoriError('Шикимори не авторизован, используйте shiki_auth')
+        if self.expiring():
+            async with self._refresh_lock:
+                if self.expiring():
+                    await self.request_token({'grant_type': 'refresh_token', 'refresh_token': self.token['refresh_token']})
+        return self.token
+
+    async def refresh_loop(self, interval=600):
+        while True:
+            try:
+                await self.get_token()
+            except ShikimoriError:
+                pass
+            except Exception as e:
+                print(f'Exception in shikimori token refresh:\n{e}')
+            await sleep(interval)
+
+    async def request(self, path, params=None):
+        for bucket in self.buckets:
+            await bucket.acquire()
+        token = await self.get_token()
+        headers = {
+            'User-Agent': self.USER_AGENT,
+            'Authorization': '{token_type} {access_token}'.format(**token)
+        }
+        return await http.get_json(self.BASE + path, headers=headers, params=params)
+
+    async def search(self, query):
+        params = {
+            'limit': 10,
+            'search': query,
+            'order': 'popularity'
+        }
+        return await self.searches.get_or_load(query.lower().strip(), lambda: self.request('/api/animes', params))
+
+    async def anime(self, anime_id):
+        return await self.details.get_or_load(anime_id, lambda: self.request(f'/api/animes/{anime_id}'))
+
+
+shikimori = Shikimori()
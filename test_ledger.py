@@ -0,0 +1,128 @@
+import asyncio
+from collections import defaultdict
+from random import Random
+
+import pytest
+
+from ledger import Ledger, WalletError
+
+START = 1000
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    ledger = Ledger(db_path=str(tmp_path / 'cookies.db'), legacy_path=str(tmp_path / 'cookies.json'), max_games=2)
+    yield ledger
+    ledger.close()
+
+
+def open_accounts(ledger, users):
+    for user_id in users:
+        ledger.open(user_id, f'user{user_id}', START)
+
+
+def test_reserve_over_balance_is_rejected(ledger):
+    open_accounts(ledger, [1])
+    with ledger.escrow(1) as escrow:
+        escrow.reserve(600)
+        with pytest.raises(WalletError):
+            escrow.reserve(500)
+        assert ledger.available(1) == START - 600
+        escrow.release()
+    assert ledger.get(1) == START
+    assert not ledger.held and not ledger.games
+
+
+def test_game_limit(ledger):
+    open_accounts(ledger, [1])
+    first, second = ledger.escrow(1), ledger.escrow(1)
+    with pytest.raises(WalletError):
+        ledger.escrow(1)
+    first.release()
+    third = ledger.escrow(1)
+    second.release()
+    third.release()
+    assert not ledger.games
+
+
+def test_concurrent_games(ledger, tmp_path):
+    users = list(range(1, 21))
+    open_accounts(ledger, users)
+    expected = {user_id: START for user_id in users}
+    live = defaultdict(int)
+    stats = defaultdict(int)
+
+    def check_invariants():
+        for user_id in users:
+            assert ledger.available(user_id) >= 0
+            assert ledger.get(user_id) - ledger.held.get(user_id, 0) >= 0
+            assert live[user_id] <= ledger.max_games
+
+    async def game(rng, user_id):
+        try:
+            escrow = ledger.escrow(user_id)
+        except WalletError:
+            stats['rejected'] += 1
+            return
+        live[user_id] += 1
+        check_invariants()
+        try:
+            with escrow:
+                bet = rng.randint(1, 400)
+                try:
+                    escrow.reserve(bet)
+                except WalletError:
+                    stats['declined'] += 1
+                    escrow.release()
+                    return
+                await asyncio.sleep(rng.random() / 1000)
+                check_invariants()
+                if rng.random() < 0.3:
+                    try:
+                        escrow.reserve(bet)
+                        bet *= 2
+                    except WalletError:
+                        stats['declined'] += 1
+                await asyncio.sleep(rng.random() / 1000)
+                check_invariants()
+                outcome = rng.random()
+                if outcome < 0.1:
+                    escrow.release()
+                    stats['released'] += 1
+                    return
+                payout = 0 if outcome < 0.5 else bet if outcome < 0.6 else bet * 2
+                escrow.pay(payout)
+                expected[user_id] += payout - bet
+                stats['committed'] += 1
+        finally:
+            live[user_id] -= 1
+            check_invariants()
+
+    async def accrue(rng):
+        for _ in range(200):
+            user_id = rng.choice(users)
+            amt = rng.randint(10, 16)
+            ledger.add(user_id, amt)
+            expected[user_id] += amt
+            await asyncio.sleep(0)
+
+    async def main():
+        rng = Random(0)
+        games = [game(Random(rng.random()), rng.choice(users)) for _ in range(2000)]
+        await asyncio.gather(accrue(Random(1)), *games)
+        await ledger.flush()
+
+    asyncio.run(main())
+
+    assert stats['rejected'] > 0
+    assert stats['committed'] > 0
+    assert not ledger.held
+    assert not ledger.games
+    assert {user_id: ledger.get(user_id) for user_id in users} == expected
+    assert all(balance >= 0 for balance in expected.values())
+
+    reopened = Ledger(db_path=str(tmp_path / 'cookies.db'), legacy_path=str(tmp_path / 'cookies.json'))
+    try:
+        assert {user_id: reopened.get(user_id) for user_id in users} == expected
+    finally:
+        reopened.close()
@@ -0,0 +1,62 @@
+import asyncio
+from pickle import dump as pdump
+
+import pytest
+
+lavalink = pytest.importorskip('lavalink')
+
+from lavalink import AudioTrack, decode_track
+from playlist_store import PlaylistStore
+
+ENCODED = ('QAAAjQIAJVJpY2sgQXN0bGV5IC0gTmV2ZXIgR29ubmEgR2l2ZSBZb3UgVXAADlJpY2tBc3RsZXlWRVZPAAAAAAADPCAAC2RRdzR3OVdnWGNRAAEAK2h0'
+           'dHBzOi8vd3d3LnlvdXR1YmUuY29tL3dhdGNoP3Y9ZFF3NHc5V2dYY1EAB3lvdXR1YmUAAAAAAAAAAA==')
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = PlaylistStore(db_path=str(tmp_path / 'playlists.db'), legacy_dir=str(tmp_path / 'playlists'))
+    yield store
+    store._db.close()
+
+
+def queued_track(title=None):
+    track = decode_track(ENCODED)
+    if title is not None:
+        track.title = title
+    return AudioTrack({'track': track.track, 'info': {
+        'identifier': track.identifier, 'isSeekable': track.is_seekable, 'author': track.author, 'length': track.duration,
+        'isStream': track.stream, 'title': track.title, 'uri': track.uri}}, 42)
+
+
+def test_round_trip(store):
+    async def main():
+        await store.save(1, 'rick', [queued_track(), queued_track('Rickroll')])
+        tracks, ln = await store.load(1, 'rick')
+        return list(tracks), ln
+
+    tracks, ln = asyncio.run(main())
+    assert ln == 2
+    assert all(track['track'] == ENCODED for track in tracks)
+    assert tracks[0]['info']['title'] == 'Rick Astley - Never Gonna Give You Up'
+    assert tracks[1]['info']['title'] == 'Rickroll'
+    track = AudioTrack(tracks[0], 1)
+    assert (track.author, track.duration, track.identifier, track.uri) == (
+        'RickAstleyVEVO', 212000, 'dQw4w9WgXcQ', 'https://www.youtube.com/watch?v=dQw4w9WgXcQ')
+
+
+def test_migration_keeps_legacy_dir_on_failure(tmp_path):
+    legacy = tmp_path / 'playlists'
+    legacy.mkdir()
+    with open(legacy / '1_rick', 'wb') as f:
+        pdump([queued_track()], f)
+    (legacy / 'stray').write_bytes(b'')
+    store = PlaylistStore(db_path=str(tmp_path / 'playlists.db'), legacy_dir=str(legacy))
+    assert store._names(1) == ['rick']
+    store._db.close()
+    assert legacy.is_dir()
+
+    (legacy / 'stray').unlink()
+    store = PlaylistStore(db_path=str(tmp_path / 'playlists.db'), legacy_dir=str(legacy))
+    assert store._names(1) == ['rick']
+    store._db.close()
+    assert not legacy.exists() and (tmp_path / 'playlists.migrated').is_dir()
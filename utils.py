@@ -1,11 +1,12 @@
-from pymorphy2 import MorphAnalyzer
-from pymorphy2.shapes import restore_capitalization
+from functools import lru_cache
 
-morph = MorphAnalyzer()
+morph = None
 
 
-broken = {
-    'печенька': ['печенька', 'печеньки', 'печенек']
+plurals = {
+    'печенька': ('печенька', 'печеньки', 'печенек'),
+    'трек': ('трек', 'трека', 'треков'),
+    'сообщение': ('сообщение', 'сообщения', 'сообщений')
 }
 
 
@@ -19,11 +20,30 @@ def form(num, arr):
     return arr[1]
 
 
+def get_morph():
+    global morph
+    if morph is None:
+        from pymorphy2 import MorphAnalyzer
+        morph = MorphAnalyzer()
+    return morph
+
+
+@lru_cache(maxsize=256)
+def parse_forms(word):
+    parsed = get_morph().parse(word)[0]
+    return tuple(parsed.make_agree_with_number(num).word for num in (1, 2, 5))
+
+
+@lru_cache(maxsize=1024)
+def restore_case(formed, word):
+    if word.islower():
+        return formed
+    from pymorphy2.shapes import restore_capitalization
+    return restore_capitalization(formed, word)
+
+
 def sform(num, word):
-    if word.lower() in broken:
-        formed = form(num, broken[word.lower()])
-    else:
-        parsed = morph.parse(word)[0]
-        formed = parsed.make_agree_with_number(num).word
-    restored = restore_capitalization(formed, word)
-    return restored
+    forms = plurals.get(word.lower())
+    if forms is None:
+        forms = parse_forms(word)
+    return restore_case(form(num, forms), word)